@@ -0,0 +1,146 @@
+"""
+Per programme cost of parsing EPG pages in Magio._epg_day, against the programme by programme parser the app had
+before the EPG pipeline was reworked: a Programme with list attributes, no string interning, no dedupe of repeated
+entries and two datetime conversions plus the replay window computed for every programme.
+
+Both parsers get the same synthetic days with every tenth entry repeated, they are checked to find the same
+programmes before timing. Parsed days are kept until the whole guide is parsed, like a generation run keeps them,
+so the garbage collector walks a growing heap as it does in the app.
+
+    python -m benchmarks.bench_parse [channels] [days] [rounds]
+"""
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import epg_items
+from libs.magioService import Magio
+
+warnings.simplefilter('ignore', DeprecationWarning)
+
+
+class LegacyProgramme:
+    def __init__(self):
+        self.id = None
+        self.start_time = None
+        self.end_time = None
+        self.title = ''
+        self.description = ''
+        self.thumbnail = ''
+        self.poster = ''
+        self.duration = 0
+        self.genres = []
+        self.actors = []
+        self.directors = []
+        self.writers = []
+        self.producers = []
+        self.seasonNo = None
+        self.episodeNo = None
+        self.year = None
+        self.is_replyable = False
+        self.metadata = {}
+
+
+def legacy_programme_data(pi):
+    def safe_int(value, default=None):
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return default
+
+    programme = LegacyProgramme()
+    programme.id = pi['programId']
+    programme.title = pi['title']
+    programme.description = pi['description']
+
+    pv = pi['programValue']
+    if pv['episodeId'] is not None:
+        programme.episodeNo = safe_int(pv['episodeId'])
+    if pv['seasonNumber'] is not None:
+        programme.seasonNo = safe_int(pv['seasonNumber'])
+    if pv['creationYear'] is not None:
+        programme.year = safe_int(pv['creationYear'])
+    for i in pi['images']:
+        programme.thumbnail = i
+        break
+    for i in pi['images']:
+        if "_VERT" in i:
+            programme.poster = i
+            break
+    for d in pi['programRole']['directors']:
+        programme.directors.append(d['fullName'])
+    for a in pi['programRole']['actors']:
+        programme.actors.append(a['fullName'])
+    if pi['programCategory'] is not None:
+        for c in pi['programCategory']['subCategories']:
+            programme.genres.append(c['desc'])
+
+    return programme
+
+
+def legacy_epg_day(channels, items, now):
+    ret = {}
+    for i in items:
+        for p in i['programs']:
+            channel = str(p['channel']['id'])
+
+            if channel not in channels:
+                continue
+
+            if channel not in ret:
+                ret[channel] = []
+
+            programme = legacy_programme_data(p['program'])
+            programme.start_time = datetime.utcfromtimestamp(p['startTimeUTC'] / 1000)
+            programme.end_time = datetime.utcfromtimestamp(p['endTimeUTC'] / 1000)
+            programme.duration = p['duration']
+            programme.is_replyable = (programme.start_time > (now - timedelta(days=7))) and (
+                    programme.end_time < now)
+
+            ret[channel].append(programme)
+    return ret
+
+
+def summary(guide):
+    # the legacy parser keeps repeated entries, the programmes found have to be the same
+    return {c: {(p.id, p.start_time, p.end_time, p.title, tuple(p.genres), p.is_replyable) for p in ps}
+            for c, ps in guide.items()}
+
+
+def measure(parse, days, rounds, count):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        guide = [parse(items) for items in days]
+        timings.append(time.perf_counter() - started)
+        del guide
+    return min(timings) / count
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    now = datetime.utcnow()
+    pages = [epg_items(now + timedelta(days=n - days // 2), channels) for n in range(days)]
+    for items in pages:
+        for item in items:
+            item['programs'] += item['programs'][::10]
+    allowed = {str(n) for n in range(1, channels + 1)}
+    count = sum(len(i['programs']) for items in pages for i in items)
+    magio = Magio('', '')
+
+    assert summary(legacy_epg_day(allowed, pages[0], now)) == summary(magio._epg_day(allowed, pages[0], now)), \
+        'parsers disagree'
+
+    legacy_time = measure(lambda items: legacy_epg_day(allowed, items, now), pages, rounds, count)
+    new_time = measure(lambda items: magio._epg_day(allowed, items, now), pages, rounds, count)
+    print('%d entries' % count)
+    print('%-8s %6.2f us/programme' % ('legacy', legacy_time * 1e6))
+    print('%-8s %6.2f us/programme' % ('batch', new_time * 1e6))
+    print('speedup: %.2fx' % (legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
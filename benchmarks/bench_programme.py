@@ -0,0 +1,104 @@
+"""
+Memory and build time of Programme objects created by Magio._programme_data.
+
+    python -m benchmarks.bench_programme [channels] [days]
+"""
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import epg_items
+from libs.magioService import Magio
+
+
+class LegacyProgramme:
+    def __init__(self):
+        self.id = None
+        self.start_time = None
+        self.end_time = None
+        self.title = ''
+        self.description = ''
+        self.thumbnail = ''
+        self.poster = ''
+        self.duration = 0
+        self.genres = []
+        self.actors = []
+        self.directors = []
+        self.writers = []
+        self.producers = []
+        self.seasonNo = None
+        self.episodeNo = None
+        self.year = None
+        self.is_replyable = False
+        self.metadata = {}
+
+
+def legacy_programme_data(pi):
+    def safe_int(value, default=None):
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return default
+
+    programme = LegacyProgramme()
+    programme.id = pi['programId']
+    programme.title = pi['title']
+    programme.description = pi['description']
+
+    pv = pi['programValue']
+    if pv['episodeId'] is not None:
+        programme.episodeNo = safe_int(pv['episodeId'])
+    if pv['seasonNumber'] is not None:
+        programme.seasonNo = safe_int(pv['seasonNumber'])
+    if pv['creationYear'] is not None:
+        programme.year = safe_int(pv['creationYear'])
+    for i in pi['images']:
+        programme.thumbnail = i
+        break
+    for i in pi['images']:
+        if "_VERT" in i:
+            programme.poster = i
+            break
+    for d in pi['programRole']['directors']:
+        programme.directors.append(d['fullName'])
+    for a in pi['programRole']['actors']:
+        programme.actors.append(a['fullName'])
+    if pi['programCategory'] is not None:
+        for c in pi['programCategory']['subCategories']:
+            programme.genres.append(c['desc'])
+
+    return programme
+
+
+def measure(name, build, programs):
+    started = time.perf_counter()
+    [build(p) for p in programs]
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = [build(p) for p in programs]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('%-10s %8.3fs %10.1f MB %8d B/programme' % (name, elapsed, size / 1024 / 1024, size / len(built)))
+    return elapsed, size
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    start = datetime.utcnow()
+    # payload strings are copied so programmes do not share them with the payload, as after json parsing
+    programs = [dict(p['program'], title=''.join(p['program']['title']))
+                for n in range(days) for i in epg_items(start + timedelta(days=n), channels) for p in i['programs']]
+    print('%d programmes' % len(programs))
+
+    magio = Magio('', '')
+    legacy_time, legacy_size = measure('legacy', legacy_programme_data, programs)
+    new_time, new_size = measure('Programme', magio._programme_data, programs)
+    print('memory saved: %.0f%%, speedup: %.2fx' % (100 - new_size * 100 / legacy_size, legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
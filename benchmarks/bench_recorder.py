@@ -0,0 +1,58 @@
+"""
+CPU cost of concurrent recordings per Recorder mode, needs ffmpeg.
+
+A synthetic H.264/AAC transport stream is generated once and then recorded by `concurrency` Recorders
+at the same time in every mode. Reported is CPU time of the ffmpeg processes per recording and per
+minute of recorded media.
+
+    python -m benchmarks.bench_recorder [concurrency] [minutes]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.recorder import Recorder, MODE_AUTO, MODE_COPY, MODE_SEGMENT, cmd
+
+
+def make_source(file_name, minutes):
+    subprocess.run([cmd or 'ffmpeg', '-y', '-loglevel', 'error',
+                    '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+                    '-f', 'lavfi', '-i', 'sine=frequency=440',
+                    '-t', str(minutes * 60), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac',
+                    '-f', 'mpegts', file_name], check=True)
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(mode, source, concurrency, minutes, directory):
+    recorders = [Recorder(source, minutes, mode, os.path.join(directory, mode)) for _ in range(concurrency)]
+    cpu = children_cpu()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda n: recorders[n].start('bench-%d-' % n), range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cpu = children_cpu() - cpu
+    print('%-8s %8.2fs wall %8.2fs CPU/recording %8.3fs CPU/media minute' % (
+        mode, elapsed, cpu / concurrency, cpu / concurrency / minutes))
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.ts')
+        make_source(source, minutes)
+        print('%d concurrent recordings of %.1f minutes' % (concurrency, minutes))
+        for mode in (MODE_AUTO, MODE_COPY, MODE_SEGMENT):
+            measure(mode, source, concurrency, minutes, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Worker start-up latency against the local fake Magio API.
+
+Measures, as medians over `rounds` fresh interpreters, how long importing the views takes and how long the
+first channel list request of a worker takes, cold and in a worker forked from a warmed-up master like
+gunicorn does with WARM_UP=1.
+
+    python -m benchmarks.bench_startup [rounds] [channels]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.fakeMagio import FakeMagio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_VIEWS = '''
+import time
+started = time.perf_counter()
+import server.views
+print(time.perf_counter() - started)
+'''
+
+FIRST_REQUEST = '''
+import json, os, time
+from server import service
+if %(warm)r:
+    service.warm_up()
+read, write = os.pipe()
+pid = os.fork()
+if pid == 0:
+    started = time.perf_counter()
+    service.get_service().get_lineup()
+    os.write(write, json.dumps(time.perf_counter() - started).encode())
+    os._exit(0)
+os.waitpid(pid, 0)
+print(os.read(read, 100).decode())
+'''
+
+
+def measure(code, env, cwd):
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=cwd, check=True, capture_output=True,
+                            text=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with FakeMagio(channels, latency=0.05) as fake, tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, PYTHONPATH=ROOT, MAGIO_API_URL=fake.url, USERNAME='user', PASSWORD='password')
+        results = {
+            'import views': [measure(IMPORT_VIEWS, env, directory) for _ in range(rounds)],
+            'first request, cold worker': [measure(FIRST_REQUEST % {'warm': False}, env, directory)
+                                           for _ in range(rounds)],
+            'first request, warm master': [measure(FIRST_REQUEST % {'warm': True}, env, directory)
+                                           for _ in range(rounds)],
+        }
+    for name, timings in results.items():
+        print('%-28s %8.1f ms' % (name, statistics.median(timings) * 1000))
+    print(json.dumps({name: statistics.median(timings) for name, timings in results.items()}))
+
+
+if __name__ == '__main__':
+    main()
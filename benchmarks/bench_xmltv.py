@@ -0,0 +1,129 @@
+"""
+Compares XmltvWriter with the writer create_epg used before on a synthetic guide.
+
+    python -m benchmarks.bench_xmltv [channels] [days]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from libs.magioService import Programme
+from libs.xmltv import XmltvWriter
+
+html_escape_table = {
+    "&": "&amp;",
+    '"': "&quot;",
+    "'": "&apos;",
+    ">": "&gt;",
+    "<": "&lt;",
+}
+
+
+def legacy_html_escape(text):
+    return "".join(html_escape_table.get(c, c) for c in text)
+
+
+def legacy_create_epg(file_name, epg):
+    html_escape = legacy_html_escape
+    with open(file_name, 'w', encoding='utf8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n')
+        file.write('<tv>\n')
+
+        for channel_id in epg:
+            file.write('<channel id="%s">\n' % channel_id)
+            file.write('</channel>\n')
+
+        for channel_id in epg:
+            for p in epg[channel_id]:
+                file.write('<programme channel="%s" start="%s" stop="%s">\n' % (
+                    channel_id, p.start_time.strftime('%Y%m%d%H%M%S'), p.end_time.strftime('%Y%m%d%H%M%S')))
+                if p.title:
+                    file.write('<title>%s</title>\n' % html_escape(p.title))
+                if p.description:
+                    file.write('<desc>%s</desc>\n' % html_escape(p.description))
+                if p.thumbnail:
+                    file.write('<icon src="%s"/>\n' % html_escape(p.thumbnail))
+                if p.genres:
+                    file.write('<category>%s</category>\n' % html_escape(', '.join(p.genres)))
+                if p.actors or p.directors or p.writers or p.producers:
+                    file.write('<credits>\n')
+                    for actor in p.actors:
+                        file.write('<actor>%s</actor>\n' % html_escape(actor))
+                    for director in p.directors:
+                        file.write('<director>%s</director>\n' % html_escape(director))
+                    for writer in p.writers:
+                        file.write('<writer>%s</writer>\n' % html_escape(writer))
+                    for producer in p.producers:
+                        file.write('<producer>%s</producer>\n' % html_escape(producer))
+                    file.write('</credits>\n')
+                if p.seasonNo and p.episodeNo:
+                    file.write(
+                        '<episode-num system="xmltv_ns">%d.%d.</episode-num>\n' % (p.seasonNo - 1, p.episodeNo - 1))
+                file.write('</programme>\n')
+        file.write('</tv>\n')
+
+
+def synthetic_guide(channels=200, days=7, per_day=30):
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    length = timedelta(minutes=24 * 60 // per_day)
+    epg = {}
+    for c in range(channels):
+        programmes = []
+        for n in range(days * per_day):
+            p = Programme()
+            p.id = c * 100000 + n
+            p.start_time = start + length * n
+            p.end_time = p.start_time + length
+            p.title = 'Programme %d' % n if n % 5 else 'Tom & Jerry <%d>' % n
+            p.description = 'A fairly long description of the programme that is shown on channel %d. ' % c * 3
+            p.thumbnail = 'https://example.com/images/%d/%d.jpg' % (c, n)
+            p.genres = ['Drama', 'Comedy']
+            p.actors = ['Actor One', 'Actor Two', "Actor O'Three"]
+            p.directors = ['Director']
+            p.seasonNo = 2
+            p.episodeNo = n % 20 + 1
+            programmes.append(p)
+        epg[str(c)] = programmes
+    return epg
+
+
+def new_create_epg(file_name, epg):
+    with XmltvWriter(file_name) as writer:
+        for channel_id in epg:
+            writer.write_channel(channel_id)
+        for channel_id in epg:
+            for p in epg[channel_id]:
+                writer.write_programme(channel_id, p)
+
+
+def measure(name, func, file_name, epg, rounds=3):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(file_name, epg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-14s %8.3fs %10.1f KB' % (name, best, os.path.getsize(file_name) / 1024))
+    return best
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    epg = synthetic_guide(channels, days)
+    print('%d channels x %d days, %d programmes' % (channels, days, sum(len(p) for p in epg.values())))
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = measure('legacy', legacy_create_epg, os.path.join(directory, 'legacy.xml'), epg)
+        new = measure('XmltvWriter', new_create_epg, os.path.join(directory, 'epg.xml'), epg)
+        measure('XmltvWriter gz', new_create_epg, os.path.join(directory, 'epg.xml.gz'), epg)
+        measure('XmltvWriter xz', new_create_epg, os.path.join(directory, 'epg.xml.xz'), epg)
+        with open(os.path.join(directory, 'legacy.xml'), 'rb') as a, open(os.path.join(directory, 'epg.xml'), 'rb') as b:
+            print('identical output: %s' % (a.read() == b.read()))
+    print('speedup: %.1fx' % (legacy / new))
+
+
+if __name__ == '__main__':
+    main()
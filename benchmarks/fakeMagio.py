@@ -0,0 +1,150 @@
+"""
+Local stand-in for the Magio API used by the benchmarks.
+
+Serves auth, channels, paged EPG, stream urls and devices for a synthetic lineup, with optional
+latency and error injection.
+
+    python -m benchmarks.fakeMagio [port] [channels]
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.synthetic import epg_items
+
+DAY_FILTER = re.compile(r'startTime=ge=(\d{4}-\d{2}-\d{2})T')
+CHANNEL_FILTER = re.compile(r'channel\.id=in=\(([\d,]*)\)')
+
+
+class FakeMagio:
+    def __init__(self, channels=200, per_day=30, latency=0.0, error_rate=0.0, port=0):
+        self.channels = channels
+        self.per_day = per_day
+        # seconds added to every response
+        self.latency = latency
+        # share of GET requests answered with HTTP 503, the client retries only those
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.devices = [{'id': n, 'name': 'Device %d' % n,
+                         'verimatrixExpirationTime': '2030-01-%02dT00:00:00.000Z' % (n + 1)} for n in range(3)]
+        self._days = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _day(self, day):
+        with self._lock:
+            if day not in self._days:
+                self._days[day] = epg_items(datetime.strptime(day, '%Y-%m-%d'), self.channels, self.per_day)
+            return self._days[day]
+
+    @staticmethod
+    def _token():
+        return {'accessToken': 'access-%f' % random.random(), 'refreshToken': 'refresh',
+                'expiresIn': int((time.time() + 3600) * 1000), 'type': 'Bearer'}
+
+    def respond(self, method, path, query):
+        if path in ('/v2/auth/init', '/v2/auth/login', '/v2/auth/tokens'):
+            return {'success': True, 'token': self._token()}
+        if path == '/v2/television/channels':
+            return {'success': True, 'items': [
+                {'channel': {'channelId': n, 'name': 'Channel %d' % n, 'logoUrl': 'https://example.com/%d.png' % n,
+                             'hasArchive': n % 2 == 0}} for n in range(1, self.channels + 1)]}
+        if path == '/v2/television/epg':
+            day = DAY_FILTER.search(query['filter'][0]).group(1)
+            offset, limit = int(query.get('offset', ['0'])[0]), int(query.get('limit', ['100'])[0])
+            items = self._day(day)
+            channels = CHANNEL_FILTER.search(query['filter'][0])
+            if channels:
+                ids = {int(i) for i in channels.group(1).split(',') if i}
+                items = [i for i in items if i['programs'][0]['channel']['id'] in ids]
+            return {'success': True, 'items': items[offset:offset + limit]}
+        if path == '/v2/television/stream-url':
+            return {'success': True, 'url': 'https://example.com/live/%s/%s.m3u8?exp=%d&token=%f' % (
+                query['id'][0], query['prof'][0], time.time() + 600, random.random())}
+        if path == '/home/listDevices':
+            return {'success': True, 'items': self.devices,
+                    'thisDevice': {'id': 99, 'name': 'This', 'verimatrixExpirationTime': '2030-02-01T00:00:00.000Z'}}
+        if path == '/home/deleteDevice':
+            self.devices = [d for d in self.devices if str(d['id']) != query['id'][0]]
+            return {'success': True}
+        return None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                fake.requests[url.path] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if method == 'GET' and fake.error_rate and random.random() < fake.error_rate:
+                    return self._send(503, {'success': False, 'errorMessage': 'injected', 'errorCode': 'FAKE'})
+                content = fake.respond(method, url.path, parse_qs(url.query))
+                if content is None:
+                    return self._send(404, {'success': False, 'errorMessage': 'not found', 'errorCode': 'NOT_FOUND'})
+                self._send(200, content)
+
+            def _send(self, code, content):
+                body = json.dumps(content).encode('utf8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    server = FakeMagio(channels=int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+                       port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    server.start()
+    print('Fake Magio API on %s' % server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,80 @@
+"""
+Offline benchmark suite of the EPG pipeline against the local fake Magio API.
+
+    python -m benchmarks.run [--channels 200] [--days 6] [--rounds 3] [--latency 0.02] [--error-rate 0]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.fakeMagio import FakeMagio
+from benchmarks.synthetic import epg_items
+from libs.magioService import Magio
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run(name, func, rounds, items):
+    """Calls `func` `rounds` times, `items` is the number of programmes one call processes."""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print('%-16s %10.0f programmes/s   p50 %8.3fs   p90 %8.3fs   p99 %8.3fs   peak %8.1f MB' % (
+        name, items / percentile(timings, 50), percentile(timings, 50), percentile(timings, 90),
+        percentile(timings, 99), peak / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--per-day', type=int, default=30)
+    parser.add_argument('--from-days', type=int, default=2)
+    parser.add_argument('--until-days', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every API response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of GET API responses failing with 503')
+    args = parser.parse_args()
+
+    days = args.from_days + args.until_days + 1
+    total = args.channels * args.per_day * days
+    print('%d channels x %d days, %d programmes, %.0fms API latency, %.0f%% API errors' % (
+        args.channels, days, total, args.latency * 1000, args.error_rate * 100))
+
+    with FakeMagio(args.channels, args.per_day, args.latency, args.error_rate) as fake, \
+            tempfile.TemporaryDirectory() as directory:
+        magio = Magio('user', 'password', args.from_days, args.until_days, base_url=fake.url,
+                      storage_file=os.path.join(directory, 'store.json'))
+        channels = magio.get_channels()
+        channel_ids = [str(c) for c in channels]
+        now = datetime.now()
+        output = os.path.join(directory, 'epg.xml')
+
+        run('generate', lambda: magio.generate(output), args.rounds, total)
+        fake.requests.clear()
+        epg = magio._epg(channel_ids, now - timedelta(days=args.from_days), now + timedelta(days=args.until_days))
+        print('_epg API requests: %s' % dict(fake.requests))
+        run('_epg', lambda: magio._epg(channel_ids, now - timedelta(days=args.from_days),
+                                       now + timedelta(days=args.until_days)), args.rounds, total)
+
+        programs = [p['program'] for n in range(days)
+                    for i in epg_items(now + timedelta(days=n), args.channels, args.per_day) for p in i['programs']]
+        run('_programme_data', lambda: [magio._programme_data(p) for p in programs], args.rounds, len(programs))
+        run('create_epg', lambda: magio.create_epg(output, epg), args.rounds, sum(len(p) for p in epg.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Synthetic Magio API payloads for the benchmarks."""
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+GENRES = ['Drama', 'Comedy', 'News', 'Sport', 'Documentary', 'Kids', 'Movie', 'Series']
+PEOPLE = ['Person %d' % n for n in range(500)]
+
+
+def program(channel_id, n, start):
+    # type: (int, int, datetime) -> dict
+    return {
+        'programId': channel_id * 1000000 + n,
+        'title': 'Programme %d' % n if n % 5 else 'Tom & Jerry <%d>' % n,
+        'description': 'A fairly long description of programme %d shown on channel %d. ' % (n, channel_id) * 3,
+        'programValue': {'episodeId': str(n % 20 + 1), 'seasonNumber': '2' if n % 3 else None,
+                         'creationYear': '2001'},
+        'images': ['https://example.com/images/%d/%d.jpg' % (channel_id, n),
+                   'https://example.com/images/%d/%d_VERT.jpg' % (channel_id, n)],
+        'programRole': {'directors': [{'fullName': PEOPLE[n % len(PEOPLE)]}],
+                        'actors': [{'fullName': PEOPLE[(n + k) % len(PEOPLE)]} for k in range(1, 4)]},
+        'programCategory': {'subCategories': [{'desc': GENRES[n % len(GENRES)]}]} if n % 4 else None,
+    }
+
+
+def epg_items(day, channels=200, per_day=30):
+    # type: (datetime, int, int) -> list
+    """All EPG items of one day as returned by the television/epg endpoint, one item per channel."""
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    length = timedelta(minutes=24 * 60 // per_day)
+    items = []
+    for channel_id in range(1, channels + 1):
+        programs = []
+        for n in range(per_day):
+            start = day + length * n
+            start_ms = int((start - EPOCH).total_seconds() * 1000)
+            programs.append({
+                'channel': {'id': channel_id},
+                'startTimeUTC': start_ms,
+                'endTimeUTC': start_ms + int(length.total_seconds() * 1000),
+                'duration': int(length.total_seconds()),
+                'program': program(channel_id, (day - EPOCH).days * per_day + n, start),
+            })
+        items.append({'programs': programs})
+    return items
@@ -2,6 +2,14 @@
 
 if ($_SERVER['REQUEST_METHOD'] == 'PUT') {
     $content = file_get_contents("php://input");
+    if (isset($_SERVER['HTTP_CONTENT_ENCODING']) && $_SERVER['HTTP_CONTENT_ENCODING'] == 'gzip') {
+        $content = gzdecode($content);
+        if ($content === false) {
+            echo "Invalid gzip content.";
+            http_response_code(400);
+            exit();
+        }
+    }
     file_put_contents('epg.xml', $content);
     echo "success";
     http_response_code(200);
@@ -0,0 +1,25 @@
+"""
+Gunicorn settings, picked up from the working directory by
+`gunicorn server.asgi -k uvicorn.workers.UvicornWorker` as the Procfile starts it.
+"""
+import os
+
+# WARM_UP=1 loads Django, logs in and fetches the channel list once in the master process, workers forked
+# from it (also respawned ones) start with all of it in place
+warm_up = os.environ.get('WARM_UP', '0') == '1'
+preload_app = warm_up
+
+
+def when_ready(server):
+    if warm_up:
+        from server import service
+        try:
+            service.warm_up()
+        except Exception as e:
+            server.log.warning('Warm-up failed: %s' % e)
+
+
+def post_fork(server, worker):
+    # recordings and scheduled EPG generation run in every worker, not only after its first request
+    from server import service
+    service.start_background()
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Callable, Dict, List
+
+from libs.magioService import Magio
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS streams (
+    channel_id INTEGER PRIMARY KEY,
+    account INTEGER NOT NULL,
+    requested_at REAL NOT NULL
+);
+'''
+
+
+class AccountPool:
+    """
+    Magio accounts recordings and live streams are spread over, so they are not bound by one account's devices.
+
+    The load is shared by all worker processes. Recordings count against the account stored on their job,
+    `recordings()` returns the running ones per account index. Players do not tell when they stop watching, a live
+    stream counts against its account for `stream_window` seconds after its url was last asked for, in SQLite, and
+    the same channel stays on the account which already has its url cached. New work goes to the account with the
+    lowest share of its device quota in use, an account with an unknown quota counts as one slot.
+    """
+
+    def __init__(self, accounts, file_name, stream_window=5 * 60, recordings=None):
+        # type: (List[Magio], str, float, Callable[[], Dict[int, int]] or None) -> None
+        if not accounts:
+            raise ValueError('At least one account is needed')
+        self.accounts = list(accounts)
+        self.file_name = file_name
+        self.stream_window = stream_window
+        self.recordings = recordings or (lambda: {})
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.file_name, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _streaming(self, conn, now):
+        # type: (sqlite3.Connection, float) -> Dict[int, int]
+        conn.execute('DELETE FROM streams WHERE requested_at < ?', (now - self.stream_window,))
+        return dict(conn.execute('SELECT account, COUNT(*) FROM streams GROUP BY account').fetchall())
+
+    def _least_loaded(self, recordings, streams):
+        # type: (Dict[int, int], Dict[int, int]) -> int
+        return min(range(len(self.accounts)), key=lambda i: (recordings.get(i, 0) + streams.get(i, 0)) /
+                   (self.accounts[i].device_quota or 1))
+
+    def for_recording(self, recordings):
+        # type: (Dict[int, int]) -> int
+        """Index of the account to record with, given the recordings running per account."""
+        with closing(self._connect()) as conn:
+            return self._least_loaded(recordings, self._streaming(conn, time.time()))
+
+    def for_stream(self, channel_id):
+        # type: (int) -> Magio
+        """Account to ask for a live stream url of the channel."""
+        recordings = self.recordings()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            streams = self._streaming(conn, now)
+            row = conn.execute('SELECT account FROM streams WHERE channel_id = ?', (channel_id,)).fetchone()
+            index = row[0] if row is not None and row[0] < len(self.accounts) else \
+                self._least_loaded(recordings, streams)
+            conn.execute('INSERT OR REPLACE INTO streams (channel_id, account, requested_at) VALUES (?, ?, ?)',
+                         (channel_id, index, now))
+            conn.execute('COMMIT')
+        return self.accounts[index]
+
+    def stats(self):
+        # type: () -> Dict[str, Dict[str, int]]
+        """Recordings and live streams per account."""
+        recordings = self.recordings()
+        with closing(self._connect()) as conn:
+            streams = self._streaming(conn, time.time())
+        return {account.user: {'recordings': recordings.get(index, 0), 'streams': streams.get(index, 0)}
+                for index, account in enumerate(self.accounts)}
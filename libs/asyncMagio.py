@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import httpx
+from urllib3.exceptions import MaxRetryError
+
+from libs.magioService import API_BYTES, API_LATENCY, API_REQUESTS, API_RETRIES, Channel, Magio, MagioGoException
+
+
+class AsyncMagio:
+    """
+    asyncio client for the Magio calls made while serving requests: channel list and stream urls.
+
+    It wraps a sync `Magio` and shares its tokens and session file, lookup cache, retry policy, metrics and
+    lineup. Upstream requests go through httpx without blocking the event loop. Logging in and freeing
+    a device slot are rare, they run the sync client's code in a thread.
+    """
+
+    def __init__(self, magio, timeout=30):
+        # type: (Magio, float) -> None
+        self.magio = magio
+        self.timeout = timeout
+        self._client = None  # type: httpx.AsyncClient or None
+        self._loop = None
+        # loads in progress, concurrent lookups of the same key await the same task
+        self._flights = {}  # type: Dict[object, asyncio.Task]
+
+    def _http(self):
+        # type: () -> httpx.AsyncClient
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # a client is bound to the event loop it was created in, WSGI servers run every request in a new one
+            size = self.magio._http.pool_size
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(
+                max_connections=size, max_keepalive_connections=size))
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _send(self, method, url, **kwargs):
+        # type: (str, str, ...) -> dict
+        endpoint = urlparse(url).path
+        retry = self.magio._http.retry
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    r = await self._http().request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    try:
+                        retry = retry.increment(method, url, error=e)
+                    except MaxRetryError:
+                        raise ConnectionError(str(e))
+                else:
+                    status = str(r.status_code)
+                    if not retry.is_retry(method, r.status_code):
+                        break
+                    try:
+                        retry = retry.increment(method, url)
+                    except MaxRetryError:
+                        break
+                API_RETRIES.inc(method=method, endpoint=endpoint)
+                await asyncio.sleep(retry.get_backoff_time())
+            API_BYTES.inc(len(r.content), method=method, endpoint=endpoint)
+            return r.json()
+        finally:
+            duration = time.perf_counter() - started
+            API_REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+            API_LATENCY.observe(duration, method=method, endpoint=endpoint)
+
+    async def _get(self, url, params=None, **kwargs):
+        resp = await self._send('GET', url, params=params, **kwargs)
+        try:
+            self.magio._check_response(resp)
+            return resp
+        except MagioGoException as e:
+            if await asyncio.to_thread(self.magio._is_max_device_limit, e):
+                resp = await self._send('GET', url, params=params, **kwargs)
+                self.magio._check_response(resp)
+                return resp
+
+    async def _login(self):
+        session = self.magio._session
+        if session.needs_login() or session.needs_refresh():
+            await asyncio.to_thread(self.magio._login)
+
+    async def _cached(self, key, loader, ttl):
+        value = self.magio._lookups.peek(key)
+        if value is not None:
+            return value
+        task = self._flights.get(key)
+        if task is None:
+            task = self._flights[key] = asyncio.ensure_future(loader())
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        value = await asyncio.shield(task)
+        self.magio._lookups.put(key, value, ttl(value) if callable(ttl) else ttl)
+        return value
+
+    async def _load_channels(self):
+        await asyncio.to_thread(self.magio._access)
+        resp = await self._get(self.magio.base_url + '/v2/television/channels',
+                               params={'list': 'LIVE', 'queryScope': 'LIVE'}, headers=self.magio._auth_headers())
+        return Magio._parse_channels(resp)
+
+    async def get_channels(self):
+        # type: () -> Dict[int, Channel]
+        return await self._cached('channels', self._load_channels, self.magio.channels_ttl)
+
+    async def get_channel(self, channel_id):
+        # type: (int) -> Channel
+        return (await self.get_channels())[channel_id]
+
+    async def get_lineup(self, group=None):
+        # type: (str or None) -> Dict[int, Channel]
+        return self.magio.lineup.select(await self.get_channels(), group)
+
+    async def _load_stream(self, channel_id, profile):
+        await self._login()
+        if self.magio.device_quota:
+            await asyncio.to_thread(self.magio.ensure_device_slot)
+        resp = await self._get(self.magio.base_url + '/v2/television/stream-url',
+                               params=Magio._stream_params(channel_id, profile), headers=self.magio._auth_headers())
+        return resp['url']
+
+    async def get_stream(self, channel_id, profile='p3', refresh=False):
+        # type: (int, str, bool) -> str
+        key = ('stream', channel_id, profile)
+        if refresh:
+            self.magio._lookups.invalidate(key)
+        return await self._cached(key, lambda: self._load_stream(channel_id, profile), self.magio.stream_url_ttl)
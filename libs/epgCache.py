@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from datetime import datetime, date
+from typing import Dict, Iterable, List, Optional
+
+
+class EpgCache:
+    """
+    On-disk cache of normalized EPG programmes, one JSON file per day.
+
+    Past days never expire, today expires after `today_ttl` seconds and future days after `future_ttl`.
+    A `scope` tells apart days cached for different channel selections. Days and `now` are UTC.
+    """
+
+    def __init__(self, directory, today_ttl=30 * 60, future_ttl=6 * 60 * 60):
+        self.directory = directory
+        self.today_ttl = today_ttl
+        self.future_ttl = future_ttl
+
+    def _file(self, day, scope=None):
+        name = 'epg-' + day.strftime('%Y-%m-%d')
+        return os.path.join(self.directory, '%s.%s.json' % (name, scope) if scope else name + '.json')
+
+    def _ttl(self, day, today):
+        # type: (date, date) -> Optional[float]
+        if day < today:
+            return None
+        if day == today:
+            return self.today_ttl
+        return self.future_ttl
+
+    def is_fresh(self, day, now=None, scope=None):
+        # type: (datetime, Optional[datetime], Optional[str]) -> bool
+        now = now or datetime.utcnow()
+        file = self._file(day, scope)
+        if not os.path.exists(file):
+            return False
+        ttl = self._ttl(day.date(), now.date())
+        return ttl is None or time.time() - os.path.getmtime(file) <= ttl
+
+    def get(self, day, now=None, scope=None):
+        # type: (datetime, Optional[datetime], Optional[str]) -> Optional[Dict[str, List[dict]]]
+        if not self.is_fresh(day, now, scope):
+            return None
+        file = self._file(day, scope)
+        try:
+            with open(file, 'r', encoding='utf8') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def put(self, day, programmes, scope=None):
+        # type: (datetime, Dict[str, List[dict]], Optional[str]) -> None
+        os.makedirs(self.directory, exist_ok=True)
+        file = self._file(day, scope)
+        tmp = file + '.tmp'
+        with open(tmp, 'w', encoding='utf8') as f:
+            json.dump(programmes, f)
+        os.replace(tmp, file)
+
+    def evict(self, keep_days):
+        # type: (Iterable[datetime]) -> None
+        if not os.path.isdir(self.directory):
+            return
+        # days are kept in every scope
+        keep = {d.strftime('%Y-%m-%d') for d in keep_days}
+        for name in os.listdir(self.directory):
+            # also files left behind by a write which did not finish
+            if name.startswith('epg-') and name.endswith(('.json', '.json.tmp')) and name[4:14] not in keep:
+                os.remove(os.path.join(self.directory, name))
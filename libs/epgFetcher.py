@@ -0,0 +1,83 @@
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class RateLimiter:
+    """Spaces out requests to the same host so at most `rate` of them start per second."""
+
+    def __init__(self, rate=10.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class EpgFetcher:
+    """
+    Fetches paged results for several keys (EPG days) concurrently.
+
+    `fetch_page(key, page)` returns `(items, has_more)`, the next page of a key is requested once the previous
+    one says there is more. Results are yielded per key, in the order the keys were given, with pages in page
+    order. Only keys up to `lookahead` past the one yielded last are fetched, so pages waiting for their turn do
+    not pile up with the number of keys, and earlier keys' pages are requested before later keys' pages.
+    """
+
+    def __init__(self, max_in_flight=4, rate_limiter=None, lookahead=None):
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.lookahead = lookahead or max_in_flight
+
+    def fetch(self, host, keys, fetch_page):
+        # type: (str, Iterable, Callable[[object, int], Tuple[List, bool]]) -> Iterable[Tuple[object, List]]
+        keys = list(keys)
+        pages = {n: {} for n in range(len(keys))}  # type: Dict[int, Dict[int, List]]
+        done = set()
+
+        def run(n, page):
+            self.rate_limiter.wait(host)
+            return fetch_page(keys[n], page)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            # (key index, page) still to request, lowest key first
+            queue = [(n, 0) for n in range(min(self.lookahead, len(keys)))]
+            admitted = len(queue)
+            pending = {}
+            emitted = 0
+            try:
+                while queue or pending:
+                    while queue and len(pending) < self.max_in_flight:
+                        n, page = heapq.heappop(queue)
+                        pending[executor.submit(run, n, page)] = (n, page)
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        n, page = pending.pop(future)
+                        items, has_more = future.result()
+                        pages[n][page] = items
+                        if has_more:
+                            heapq.heappush(queue, (n, page + 1))
+                        else:
+                            done.add(n)
+
+                    while emitted in done:
+                        yield keys[emitted], [i for p in sorted(pages[emitted]) for i in pages[emitted][p]]
+                        del pages[emitted]
+                        emitted += 1
+                    while admitted < min(emitted + self.lookahead, len(keys)):
+                        heapq.heappush(queue, (admitted, 0))
+                        admitted += 1
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS programmes (
+    channel TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    programme_id INTEGER,
+    title TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (channel, start_time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS programmes_start ON programmes (start_time, end_time);
+CREATE INDEX IF NOT EXISTS programmes_id ON programmes (programme_id);
+'''
+
+
+class EpgStore:
+    """
+    SQLite store of EPG programmes keyed by channel and start time.
+
+    Programmes go in and come out as `Programme.to_dict()` dictionaries, times are UTC epoch seconds.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.file_name)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.file_name, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # readers (web workers) are not blocked while the EPG generation writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, channel, programmes):
+        # type: (str, List[dict]) -> None
+        """Replaces the channel's programmes in the time range covered by `programmes`."""
+        if not programmes:
+            return
+        start = min(int(p['start_time']) for p in programmes)
+        end = max(int(p['end_time']) for p in programmes)
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM programmes WHERE channel = ? AND start_time >= ? AND start_time < ?',
+                         (channel, start, end))
+            conn.executemany(
+                'INSERT INTO programmes (channel, start_time, end_time, programme_id, title, data) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (channel, start_time) DO UPDATE SET end_time = excluded.end_time, '
+                'programme_id = excluded.programme_id, title = excluded.title, data = excluded.data',
+                [(channel, int(p['start_time']), int(p['end_time']), p['id'], p['title'], json.dumps(p))
+                 for p in programmes])
+
+    def prune(self, before):
+        # type: (int) -> None
+        """Removes programmes which ended before `before`."""
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM programmes WHERE end_time < ?', (before,))
+
+    def programmes(self, channel, start, end):
+        # type: (str, int, int) -> List[dict]
+        """Programmes of `channel` airing at any moment between `start` and `end`."""
+        rows = self._connection().execute(
+            'SELECT data FROM programmes WHERE channel = ? AND start_time < ? AND end_time > ? ORDER BY start_time',
+            (channel, end, start))
+        return [json.loads(r['data']) for r in rows]
+
+    def programme(self, programme_id, at=None):
+        # type: (int, Optional[int]) -> Optional[dict]
+        """
+        Next airing of the programme which has not ended at time `at`, by default now. A programme id is
+        shared by its reruns, ended airings of past days are kept too.
+        """
+        at = int(time.time()) if at is None else at
+        row = self._connection().execute(
+            'SELECT channel, data FROM programmes WHERE programme_id = ? AND end_time > ? ORDER BY start_time LIMIT 1',
+            (programme_id, at)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row['data'])
+        data['channel'] = row['channel']
+        return data
+
+    def now_next(self, at, channels=None):
+        # type: (int, Optional[Iterable[str]]) -> Dict[str, Dict[str, Optional[dict]]]
+        """Currently airing and following programme of every channel at time `at`."""
+        conn = self._connection()
+        ret = {}
+        for row in conn.execute('SELECT channel, data FROM programmes WHERE start_time <= ? AND end_time > ?',
+                                (at, at)):
+            ret.setdefault(row['channel'], {'now': None, 'next': None})['now'] = json.loads(row['data'])
+        for row in conn.execute(
+                'SELECT p.channel, p.data FROM programmes p JOIN ('
+                'SELECT channel, MIN(start_time) AS start_time FROM programmes '
+                'WHERE start_time > ? GROUP BY channel) n '
+                'ON p.channel = n.channel AND p.start_time = n.start_time', (at,)):
+            ret.setdefault(row['channel'], {'now': None, 'next': None})['next'] = json.loads(row['data'])
+        if channels is not None:
+            channels = set(channels)
+            ret = {c: v for c, v in ret.items() if c in channels}
+        return ret
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
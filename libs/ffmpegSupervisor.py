@@ -0,0 +1,72 @@
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+class FfmpegProcess:
+    """
+    Runs one ffmpeg command without buffering its output.
+
+    `-progress` reports from stdout are parsed as they arrive, stderr is kept only as a bounded ring buffer
+    of the last `log_lines` lines.
+    """
+
+    def __init__(self, args, log_lines=200):
+        # args of an ffmpeg command, the progress options are added here
+        self.args = args[:1] + ['-nostats', '-progress', 'pipe:1'] + args[1:]
+        self.log = deque(maxlen=log_lines)
+        # bytes written, seconds of media written, bitrate and speed as reported by ffmpeg
+        self.total_size = 0
+        self.out_time = 0.0
+        self.bitrate = ''
+        self.speed = ''
+        # monotonic time when the output last grew or its media time advanced, HLS output reports no size
+        self.last_advance = time.monotonic()
+        self._process = None  # type: subprocess.Popen or None
+        self._threads = []
+
+    def start(self):
+        self._process = subprocess.Popen(self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        self._threads = [threading.Thread(target=self._read_progress, daemon=True),
+                         threading.Thread(target=self._read_log, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _read_progress(self):
+        for line in self._process.stdout:
+            key, _, value = line.decode('utf8', 'replace').strip().partition('=')
+            if key == 'total_size' and value.isdigit():
+                if int(value) > self.total_size:
+                    self.last_advance = time.monotonic()
+                self.total_size = int(value)
+            elif key == 'out_time_us' and value.lstrip('-').isdigit():
+                out_time = max(int(value), 0) / 1000000
+                if out_time > self.out_time:
+                    self.last_advance = time.monotonic()
+                self.out_time = out_time
+            elif key == 'bitrate':
+                self.bitrate = value
+            elif key == 'speed':
+                self.speed = value
+
+    def _read_log(self):
+        for line in self._process.stderr:
+            self.log.append(line.decode('utf8', 'replace').rstrip())
+
+    def poll(self):
+        return self._process.poll()
+
+    def stalled_for(self):
+        return time.monotonic() - self.last_advance
+
+    def wait(self):
+        returncode = self._process.wait()
+        for thread in self._threads:
+            thread.join()
+        return returncode
+
+    def terminate(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+IDLE = 'idle'
+FAILED = 'failed'
+DONE = 'done'
+
+
+class GenerationWorker:
+    """
+    Runs EPG generation in one long-lived background thread.
+
+    Triggers arriving while a generation runs join it instead of starting another one, also across processes
+    thanks to a file lock. The current phase and progress are shared through `status_file`, so every web
+    worker reports the same status. With `interval` set, generation also repeats on its own every `interval`
+    seconds.
+    """
+
+    def __init__(self, job, status_file, interval=None):
+        # job(progress) generates the EPG and reports through progress(phase, done, total)
+        self.job = job
+        self.status_file = status_file
+        self.lock_file = status_file + '.lock'
+        self.interval = interval
+        self._thread = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._status = {'phase': IDLE, 'done': 0, 'total': 0, 'started_at': None, 'finished_at': None,
+                        'error': None, 'running': False}
+
+    def trigger(self):
+        # type: () -> bool
+        """Starts a generation, returns False when one is already running and the trigger joined it."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            lock = self._acquire_file_lock()
+            if lock is False:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(lock,), name='epg-generation', daemon=True)
+            self._thread.start()
+            return True
+
+    def _acquire_file_lock(self):
+        if fcntl is None:
+            return None
+        directory = os.path.dirname(self.lock_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock = open(self.lock_file, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        return lock
+
+    def _run(self, lock):
+        self._update(phase='starting', done=0, total=0, started_at=time.time(), finished_at=None, error=None,
+                     running=True)
+        try:
+            self.job(self._progress)
+            self._update(phase=DONE, finished_at=time.time(), running=False)
+        except BaseException as e:
+            # also MagioGoException, the status would stay running with the error lost
+            logging.error('EPG generation failed: %s' % e)
+            self._update(phase=FAILED, error=str(e), finished_at=time.time(), running=False)
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+    def _progress(self, phase, done=0, total=0):
+        self._update(phase=phase, done=done, total=total)
+
+    def _update(self, **values):
+        self._status.update(values)
+        tmp = '%s.%d.tmp' % (self.status_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self._status, f)
+        os.replace(tmp, self.status_file)
+
+    def status(self):
+        # type: () -> dict
+        try:
+            with open(self.status_file, 'r') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return dict(self._status)
+        if status['running'] and fcntl is not None:
+            lock = self._acquire_file_lock()
+            if lock:
+                # nobody holds the lock, the process running the generation died
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+                status.update(phase=FAILED, error='interrupted', running=False)
+        return status
+
+    def start_schedule(self):
+        """Triggers a generation every `interval` seconds."""
+        if not self.interval or self._timer is not None:
+            return
+        self._timer = threading.Thread(target=self._schedule, name='epg-schedule', daemon=True)
+        self._timer.start()
+
+    def _schedule(self):
+        while True:
+            status = self.status()
+            last = status.get('finished_at') or status.get('started_at') or 0
+            wait = last + self.interval - time.time()
+            if wait <= 0:
+                self.trigger()
+                wait = self.interval
+            time.sleep(max(wait, 1))
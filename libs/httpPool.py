@@ -0,0 +1,59 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+
+def default_retry():
+    return Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
+
+
+class PooledSession:
+    """Keep-alive requests session shared by all threads of one Magio instance."""
+
+    def __init__(self, pool_size=10, retry=None):
+        self.pool_size = pool_size
+        self.retry = retry or default_retry()
+        self._session = None
+        self._adapter = None
+        self._lock = threading.Lock()
+
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                          max_retries=self.retry, pool_block=True)
+                    session = requests.Session()
+                    session.headers['Connection'] = 'keep-alive'
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._adapter = adapter
+                    self._session = session
+        return self._session
+
+    def get(self, url, **kwargs):
+        return self.session().get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session().post(url, **kwargs)
+
+    def stats(self):
+        # urllib3 counts every connection it opens and every request it sends per host pool
+        opened = 0
+        requests_sent = 0
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            with pools.lock:
+                for key in list(pools.keys()):
+                    pool = pools[key]
+                    opened += pool.num_connections
+                    requests_sent += pool.num_requests
+        return {'opened': opened, 'reused': max(requests_sent - opened, 0), 'requests': requests_sent}
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
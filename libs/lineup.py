@@ -0,0 +1,89 @@
+import json
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+
+class Lineup:
+    """
+    Channels the user wants in the guide.
+
+    Channels are given by id or name in `channels`, in named `groups` and in `favourites`, together they form
+    the allow-list. An empty allow-list lets every channel through. With `upstream` set, EPG requests ask the
+    API for the allowed channels only instead of filtering the full guide locally.
+    """
+
+    def __init__(self, channels=(), groups=None, favourites=(), upstream=False):
+        # type: (Iterable, Dict[str, List] or None, Iterable, bool) -> None
+        self.channels = list(channels)
+        self.groups = OrderedDict(groups or {})  # type: Dict[str, List]
+        self.favourites = list(favourites)
+        self.upstream = upstream
+
+    @staticmethod
+    def load(file_name):
+        # type: (str or None) -> Lineup
+        """
+        Reads a lineup from a JSON file like
+        `{"channels": [1, "JOJ"], "groups": {"Sport": [...]}, "favourites": [...], "upstream": true}`,
+        a missing file is an empty lineup.
+        """
+        if not file_name:
+            return Lineup()
+        try:
+            with open(file_name, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return Lineup()
+        return Lineup(data.get('channels', ()), data.get('groups'), data.get('favourites', ()),
+                      bool(data.get('upstream', False)))
+
+    @property
+    def restricted(self):
+        # type: () -> bool
+        return bool(self.channels or self.favourites or any(self.groups.values()))
+
+    @staticmethod
+    def _resolve(entries, channels):
+        # type: (Iterable, Dict[int, object]) -> List[int]
+        names = {c.name.lower(): c.id for c in channels.values()}
+        ret = []
+        for entry in entries:
+            channel_id = entry if isinstance(entry, int) else names.get(str(entry).lower())
+            if channel_id is None and str(entry).isdigit():
+                channel_id = int(entry)
+            if channel_id in channels and channel_id not in ret:
+                ret.append(channel_id)
+        return ret
+
+    def favourite_ids(self, channels):
+        # type: (Dict[int, object]) -> List[int]
+        return self._resolve(self.favourites, channels)
+
+    def group_ids(self, channels):
+        # type: (Dict[int, object]) -> Dict[str, List[int]]
+        return OrderedDict((name, self._resolve(entries, channels)) for name, entries in self.groups.items())
+
+    def channel_groups(self, channels):
+        # type: (Dict[int, object]) -> Dict[int, str]
+        """The first group every grouped channel is in."""
+        ret = {}
+        for name, ids in self.group_ids(channels).items():
+            for channel_id in ids:
+                ret.setdefault(channel_id, name)
+        return ret
+
+    def select(self, channels, group=None):
+        # type: (Dict[int, object], str or None) -> Dict[int, object]
+        """Allowed channels, favourites first and the rest in the order of `channels`, optionally of one group."""
+        if group is not None:
+            allowed = set(self.group_ids(channels).get(group, ()))
+        elif self.restricted:
+            allowed = set(self._resolve(self.channels, channels)).union(
+                self.favourite_ids(channels), *self.group_ids(channels).values())
+        else:
+            allowed = set(channels)
+        ret = OrderedDict((i, channels[i]) for i in self.favourite_ids(channels) if i in allowed)
+        for channel_id, channel in channels.items():
+            if channel_id in allowed and channel_id not in ret:
+                ret[channel_id] = channel
+        return ret
@@ -1,35 +1,91 @@
+import hashlib
 import os
-from typing import List, Dict
+import re
+import sys
+from contextlib import nullcontext
+from sys import intern
+from typing import List, Dict, Iterator, Tuple
 
 import requests
 import time
 import random
-import json
 from datetime import datetime, timedelta
-
-from requests.adapters import HTTPAdapter, Retry
-
+from urllib.parse import urlparse
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from libs.epgCache import EpgCache
+from libs.epgFetcher import EpgFetcher, RateLimiter
+from libs.epgStore import EpgStore
+from libs.httpPool import PooledSession
+from libs.lineup import Lineup
+from libs.metrics import REGISTRY, Trace
+from libs.session import SessionData, SessionManager
+from libs.ttlCache import TtlCache
+from libs.xmltv import XmltvWriter, html_escape
+
+EPOCH = datetime(1970, 1, 1)
+# channels per page of the television/epg endpoint
+EPG_PAGE_SIZE = 100
+# expiration epoch in query parameters of signed stream urls, also inside tokens like hdnts=exp=...~acl=...
+STREAM_EXPIRY = re.compile(r'[?&~;=](?:exp|expires|expiry|validto)=(\d{10,13})(?:[&~;#]|$)', re.IGNORECASE)
+# seconds before a stream url expires when it is dropped from the cache
+STREAM_EXPIRY_MARGIN = 30
+# error codes of a rejected or expired session, stream urls cached under that session are no use any more
+SESSION_ERROR = re.compile(r'TOKEN|AUTH|LOGIN|SESSION|CREDENTIAL', re.IGNORECASE)
+# name this client registers its device under, its devices are removed first when the quota is full
+DEVICE_NAME = 'TV'
 UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0'
 
-html_escape_table = {
-    "&": "&amp;",
-    '"': "&quot;",
-    "'": "&apos;",
-    ">": "&gt;",
-    "<": "&lt;",
-}
-
-
-def html_escape(text):
-    return "".join(html_escape_table.get(c, c) for c in text)
-
-
-class SessionData:
-    def __init__(self):
-        self.access_token = ''
-        self.refresh_token = ''
-        self.expires_in = 0
-        self.type = ''
+API_REQUESTS = REGISTRY.counter('magio_api_requests_total', 'Magio API requests by response status',
+                                ('method', 'endpoint', 'status'))
+API_LATENCY = REGISTRY.histogram('magio_api_request_seconds', 'Magio API request latency including retries',
+                                 ('method', 'endpoint'))
+API_RETRIES = REGISTRY.counter('magio_api_retries_total', 'Magio API requests retried by the HTTP pool',
+                               ('method', 'endpoint'))
+API_BYTES = REGISTRY.counter('magio_api_response_bytes_total', 'Bytes of Magio API response bodies',
+                             ('method', 'endpoint'))
+EPG_PHASES = REGISTRY.histogram('magio_epg_phase_seconds', 'Time an EPG generation spent in a phase', ('phase',),
+                                buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+EPG_GENERATIONS = REGISTRY.counter('magio_epg_generations_total', 'EPG generations by result', ('result',))
+DEVICE_EVICTIONS = REGISTRY.counter('magio_device_evictions_total',
+                                    'Devices removed to free a slot, ahead of a stream request or after an error',
+                                    ('reason',))
+EPG_PROGRAMMES = REGISTRY.gauge('magio_epg_programmes', 'Programmes per channel in the last generated EPG',
+                                ('channel',))
+
+def timestamp(value):
+    # type: (datetime) -> int
+    """Epoch seconds of a naive UTC datetime."""
+    return int((value - EPOCH).total_seconds())
+
+
+def url_expiry(url):
+    # type: (str) -> float or None
+    """Epoch seconds when a signed url expires, None when it does not say."""
+    match = STREAM_EXPIRY.search(url)
+    if match is None:
+        return None
+    value = int(match.group(1))
+    return value / 1000 if value > 10 ** 12 else value
+
+
+def utc_datetimes(values):
+    # type: (List[int]) -> List[datetime]
+    """Naive UTC datetimes of epoch milliseconds, a value repeated like the end of one programme and the start of
+    the next is converted once."""
+    converted = {value: datetime.utcfromtimestamp(value / 1000) for value in set(values)}
+    return [converted[value] for value in values]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
 
 
 class MagioGoDevice:
@@ -40,9 +96,64 @@ class MagioGoDevice:
         self.is_this = False
 
 
+def _proc_status_kb(field):
+    # type: (str) -> int or None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class PipelineStats:
+    def __init__(self):
+        # programmes received from the API, before channel filtering
+        self.fetched = 0
+        # programmes received more than once, e.g. from overlapping pages
+        self.duplicates = 0
+        # programmes parsed or loaded from cache
+        self.parsed = 0
+        # programmes written to the XMLTV file
+        self.written = 0
+        # peak resident memory of the process in MB since reset_peak_memory()
+        self.peak_memory = 0.0
+        self._peak_reset = False
+
+    def reset_peak_memory(self):
+        """Starts measuring the peak anew, a long-lived process would otherwise report the peak of an earlier run."""
+        self.peak_memory = 0.0
+        try:
+            # resets VmHWM, the peak resident memory the kernel keeps for the process (Linux 4.0+)
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            self._peak_reset = True
+        except OSError:
+            self._peak_reset = False
+
+    def update_peak_memory(self):
+        rss = _proc_status_kb('VmHWM' if self._peak_reset else 'VmRSS')
+        if rss is not None:
+            # without a reset the current resident memory is sampled instead of the all-time peak
+            self.peak_memory = max(self.peak_memory, rss / 1024)
+        elif resource is not None:
+            # all-time peak of the process, ru_maxrss is in kilobytes on Linux but in bytes on macOS
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak_memory = rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    def __repr__(self):
+        return 'fetched=%d duplicates=%d parsed=%d written=%d peak_memory=%.1fMB' % (
+            self.fetched, self.duplicates, self.parsed, self.written, self.peak_memory)
+
+
 class Base:
+    __slots__ = ()
+
     def __repr__(self):
-        return str(__dict__)
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__ if not name.startswith('_')))
 
 
 class MagioGoException(BaseException):
@@ -52,6 +163,8 @@ class MagioGoException(BaseException):
 
 
 class Channel(Base):
+    __slots__ = ('id', 'name', 'logo', 'is_pin_protected', 'archive_days', 'metadata')
+
     def __init__(self):
         # channel Unique Id
         self.id = None  # type: int or None
@@ -68,6 +181,12 @@ class Channel(Base):
 
 
 class Programme(Base):
+    # guides hold hundreds of thousands of programmes, so they have no __dict__, empty credits share
+    # one empty tuple and metadata dict is only created when it is asked for
+    __slots__ = ('id', 'start_time', 'end_time', 'title', 'description', 'thumbnail', 'poster', 'duration',
+                 'genres', 'actors', 'directors', 'writers', 'producers', 'seasonNo', 'episodeNo', 'year',
+                 'is_replyable', '_metadata')
+
     def __init__(self):
         self.id = None  # type: int or None
         # Programme Start Time in UTC
@@ -79,43 +198,125 @@ class Programme(Base):
         self.thumbnail = ''
         self.poster = ''
         self.duration = 0
-        self.genres = []  # type: List[str]
-        self.actors = []  # type: List[str]
-        self.directors = []  # type: List[str]
-        self.writers = []  # type: List[str]
-        self.producers = []  # type: List[str]
+        self.genres = ()  # type: Tuple[str, ...]
+        self.actors = ()  # type: Tuple[str, ...]
+        self.directors = ()  # type: Tuple[str, ...]
+        self.writers = ()  # type: Tuple[str, ...]
+        self.producers = ()  # type: Tuple[str, ...]
         self.seasonNo = None
         self.episodeNo = None
         self.year = None  # type: int or None
         self.is_replyable = False
-        # programme metadata
-        self.metadata = {}  # type: Dict[str, int]
+        self._metadata = None
+
+    # programme metadata
+    @property
+    def metadata(self):
+        # type: () -> Dict[str, int]
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+        data['metadata'] = self._metadata or {}
+        data['start_time'] = timestamp(self.start_time) if self.start_time else None
+        data['end_time'] = timestamp(self.end_time) if self.end_time else None
+        return data
+
+    @staticmethod
+    def from_dict(data):
+        programme = Programme()
+        for name, value in data.items():
+            if name in _programme_names:
+                value = tuple(intern(v) for v in value)
+            setattr(programme, name, value)
+        if data['start_time'] is not None:
+            programme.start_time = EPOCH + timedelta(seconds=data['start_time'])
+        if data['end_time'] is not None:
+            programme.end_time = EPOCH + timedelta(seconds=data['end_time'])
+        if not programme._metadata:
+            programme._metadata = None
+        return programme
+
+
+# attributes holding genre and person names, these repeat a lot across a guide and are interned
+_programme_names = ('genres', 'actors', 'directors', 'writers', 'producers')
+
+
+def timeline(programmes):
+    # type: (List[Programme]) -> List[Programme]
+    """
+    Sorts programmes of one channel by start time and removes overlaps: of programmes starting at the same
+    time the longest one is kept, otherwise a programme is cut short when the next one starts.
+    """
+    programmes.sort(key=lambda p: (p.start_time, p.end_time))
+    ret = []  # type: List[Programme]
+    for programme in programmes:
+        if ret and programme.start_time < ret[-1].end_time:
+            previous = ret[-1]
+            if programme.start_time == previous.start_time:
+                ret[-1] = programme
+                continue
+            previous.end_time = programme.start_time
+            previous.duration = int((previous.end_time - previous.start_time).total_seconds())
+        ret.append(programme)
+    return ret
 
 
 class Magio:
-    def __init__(self, username, password, from_days=2, until_days=3):
-        self._data = SessionData()
+    def __init__(self, username, password, from_days=2, until_days=3, pool_size=10, max_in_flight=4,
+                 rate_limit=10.0, cache_dir=None, store_file=None, channels_ttl=60 * 60, stream_ttl=2 * 60,
+                 devices_ttl=60, base_url='https://skgo.magio.tv', storage_file=None, trace_dir=None, lineup=None,
+                 device_quota=None):
+        self._http = PooledSession(pool_size)
+        self._fetcher = EpgFetcher(max_in_flight, RateLimiter(rate_limit))
+        self._cache = EpgCache(cache_dir) if cache_dir else None
+        self.store = EpgStore(store_file) if store_file else None
         self.user = username
         self.password = password
         self.from_days = from_days
         self.to_days = until_days
-        self._channels = {}
-        self.storage_file = os.path.join(os.path.curdir, 'store.json')
-
-    def _store_session(self, data):
-        with open(self.storage_file, 'w+') as f:
-            json.dump(data.__dict__, f)
-
-    def _load_session(self, data):
-        if os.path.exists(self.storage_file):
-            with open(self.storage_file, 'r') as f:
-                data.__dict__ = json.load(f)
+        # channel list, stream urls and devices
+        self._lookups = TtlCache()
+        self.channels_ttl = channels_ttl
+        self.stream_ttl = stream_ttl
+        self.devices_ttl = devices_ttl
+        # devices the account may have registered at once, learnt from the first DEVICE_MAX_LIMIT error if not given
+        self.device_quota = device_quota  # type: int or None
+        self.stats = PipelineStats()
+        self.base_url = base_url
+        self._host = urlparse(base_url).netloc
+        self.storage_file = storage_file or os.path.join(os.path.curdir, 'store.json')
+        self._session = SessionManager(self.storage_file)
+        # directory a JSON trace of every generate run is saved to
+        self.trace_dir = trace_dir
+        self.trace = None  # type: Trace or None
+        # channels included in the guide
+        self.lineup = lineup or Lineup()  # type: Lineup
+
+    @property
+    def _data(self) -> SessionData:
+        return self._session.data
+
+    def _phase(self, name, **attributes):
+        return self.trace.phase(name, **attributes) if self.trace is not None else nullcontext()
 
     def _load_channels(self) -> Dict:
         self._access()
-        resp = self._get('https://skgo.magio.tv/v2/television/channels',
+        resp = self._get(self.base_url + '/v2/television/channels',
                          params={'list': 'LIVE', 'queryScope': 'LIVE'},
                          headers=self._auth_headers())
+        ret = self._parse_channels(resp)
+        self._lookups.put('channels', ret, self.channels_ttl)
+        return ret
+
+    @staticmethod
+    def _parse_channels(resp) -> Dict:
         ret = {}
         for i in resp['items']:
             i = i['channel']
@@ -126,75 +327,220 @@ class Magio:
             if i['hasArchive']:
                 c.archive_days = 7
             ret[c.id] = c
-        self._channels = ret
         return ret
 
-    def get_stream(self, channel_id):
+    @staticmethod
+    def _stream_params(channel_id, profile):
+        return {'service': 'LIVE', 'name': DEVICE_NAME, 'devtype': 'OTT_ANDROID', 'id': channel_id, 'prof': profile,
+                'ecid': '', 'drm': 'verimatrix'}
+
+    def _load_stream(self, channel_id, profile):
         self._login()
-        resp = self._get('https://skgo.magio.tv/v2/television/stream-url',
-                         params={'service': 'LIVE', 'name': 'TV', 'devtype': 'OTT_ANDROID',
-                                 'id': channel_id, 'prof': 'p3', 'ecid': '', 'drm': 'verimatrix'},
+        self.ensure_device_slot()
+        resp = self._get(self.base_url + '/v2/television/stream-url', params=self._stream_params(channel_id, profile),
                          headers=self._auth_headers())
         return resp['url']
 
+    def stream_url_ttl(self, url):
+        # type: (str) -> float
+        """Seconds a stream url is cached, until shortly before it expires or `stream_ttl` if it does not say."""
+        expires = url_expiry(url)
+        if expires is None:
+            return self.stream_ttl
+        return max(expires - time.time() - STREAM_EXPIRY_MARGIN, 0)
+
+    def get_stream(self, channel_id, profile='p3', refresh=False):
+        if refresh:
+            self._lookups.invalidate(('stream', channel_id, profile))
+        return self._lookups.get(('stream', channel_id, profile), lambda: self._load_stream(channel_id, profile),
+                                 self.stream_url_ttl)
+
     def get_channels(self):
-        if not self._channels:
-            self._load_channels()
-        return self._channels
+        return self._lookups.get('channels', self._load_channels, self.channels_ttl)
+
+    def cache_stats(self):
+        return self._lookups.stats()
 
     def get_channel(self, channel_id) -> Channel:
         return self.get_channels()[channel_id]
 
-    def _epg(self, channels, from_date, to_date):
-        self._login()
+    def get_lineup(self, group=None):
+        # type: (str or None) -> Dict[int, Channel]
+        """Channels allowed by the lineup, favourites first."""
+        return self.lineup.select(self.get_channels(), group)
+
+    def _epg_page(self, day, page, channel_ids=None):
+        # programmes starting within the day, a programme running over midnight belongs to the day it starts
+        day = day.strftime("%Y-%m-%d")
+        time_filter = 'startTime=ge=%sT00:00:00.000Z;startTime=le=%sT23:59:59.999Z' % (day, day)
+        if channel_ids:
+            time_filter = 'channel.id=in=(%s);%s' % (','.join(str(i) for i in channel_ids), time_filter)
+        resp = self._get(self.base_url + '/v2/television/epg',
+                         params={'filter': time_filter, 'limit': EPG_PAGE_SIZE, 'offset': page * EPG_PAGE_SIZE,
+                                 'list': 'LIVE'},
+                         headers=self._auth_headers())
+        # a short page is the last one
+        return resp['items'], len(resp['items']) == EPG_PAGE_SIZE
+
+    def _epg_day(self, channels, items, now):
+        # entries of allowed channels without duplicates are collected first and then parsed as one batch
+        entries = []
+        keys = []
+        seen = set()
+        names = {}
+        fetched = duplicates = 0
+        for i in items:
+            programs = i['programs']
+            fetched += len(programs)
+            for p in programs:
+                channel_id = p['channel']['id']
+                channel = names.get(channel_id)
+                if channel is None:
+                    channel = names[channel_id] = str(channel_id)
+                if channel not in channels:
+                    continue
+
+                key = (channel, p['program']['programId'], p['startTimeUTC'])
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                entries.append(p)
+                keys.append(channel)
+        self.stats.fetched += fetched
+        self.stats.duplicates += duplicates
+        self.stats.parsed += len(entries)
+
+        ret = {}
+        for channel, programme in zip(keys, self._parse_programmes(entries)):
+            programmes = ret.get(channel)
+            if programmes is None:
+                programmes = ret[channel] = []
+            programmes.append(programme)
+
+        # replays are kept for a week
+        replay_from = now - timedelta(days=7)
+        for channel, programmes in ret.items():
+            programmes = ret[channel] = timeline(programmes)
+            for programme in programmes:
+                programme.is_replyable = replay_from < programme.start_time and programme.end_time < now
+        return ret
+
+    def _parse_programmes(self, entries):
+        # type: (List[dict]) -> List[Programme]
+        """Programmes of EPG entries, the start and end times of all entries are converted in one pass."""
+        count = len(entries)
+        times = utc_datetimes([e['startTimeUTC'] for e in entries] + [e['endTimeUTC'] for e in entries])
+        ret = []
+        append = ret.append
+        programme_data = self._programme_data
+        for e, start_time, end_time in zip(entries, times, times[count:]):
+            programme = programme_data(e['program'])
+            programme.start_time = start_time
+            programme.end_time = end_time
+            programme.duration = e['duration']
+            append(programme)
+        return ret
+
+    def _cached_day(self, day, now, scope=None):
+        data = self._cache.get(day, now, scope)
+        if data is None:
+            return None
         ret = {}
+        for channel, programmes in data.items():
+            # days cached before overlapping pages were fixed may hold duplicates
+            ret[channel] = timeline([Programme.from_dict(p) for p in programmes])
+            for programme in ret[channel]:
+                programme.is_replyable = (programme.start_time > (now - timedelta(days=7))) and (
+                        programme.end_time < now)
+            self.stats.parsed += len(ret[channel])
+        return ret
 
+    def _iter_epg(self, channels, from_date, to_date):
+        # type: (...) -> Iterator[Tuple[datetime, Dict[str, List[Programme]]]]
+        """Yields programmes of one day at a time, days in window order, so only a day has to be held in memory."""
         from_date = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
         to_date = to_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
         now = datetime.utcnow()
+        # programmes reference channels by id, compare them as strings which is how the guide is keyed
+        channels = {str(c) for c in channels}
+        # the cache holds the programmes of the selected channels only
+        scope = hashlib.sha1(','.join(sorted(channels)).encode('ascii')).hexdigest()[:12]
+        channel_ids = sorted(int(c) for c in channels) if self.lineup.upstream and self.lineup.restricted else None
+
+        def fetch_page(day, page):
+            return self._epg_page(day, page, channel_ids)
+
+        days = [from_date + timedelta(n) for n in range(int((to_date - from_date).days))]
+        fresh = set()
+
+        if self._cache is not None:
+            self._cache.evict(days)
+            fresh = {day for day in days if self._cache.is_fresh(day, now, scope)}
+
+        stale = [day for day in days if day not in fresh]
+        if stale:
+            self._login()
+        fetched = iter(self._fetcher.fetch(self._host, stale, fetch_page)) if stale else iter(())
+
+        for day in days:
+            label = day.strftime('%Y-%m-%d')
+            programmes = None
+            if day in fresh:
+                with self._phase('parse', day=label, cached=True):
+                    programmes = self._cached_day(day, now, scope)
+            serialized = None
+            if programmes is None:
+                with self._phase('fetch', day=label):
+                    if day in fresh:
+                        # cache file turned out to be unreadable
+                        self._login()
+                        _, items = next(iter(self._fetcher.fetch(self._host, [day], fetch_page)))
+                    else:
+                        _, items = next(fetched)
+                with self._phase('parse', day=label):
+                    programmes = self._epg_day(channels, items, now)
+                if self._cache is not None:
+                    with self._phase('store', day=label):
+                        serialized = {c: [p.to_dict() for p in progs] for c, progs in programmes.items()}
+                        self._cache.put(day, serialized, scope)
+            if self.store is not None:
+                with self._phase('store', day=label):
+                    serialized = serialized or {c: [p.to_dict() for p in progs] for c, progs in programmes.items()}
+                    for channel, items in serialized.items():
+                        self.store.upsert(channel, items)
+            self.stats.update_peak_memory()
+            yield day, programmes
+
+        if self.store is not None:
+            self.store.prune(timestamp(from_date))
+
+    def whats_on(self, channel_id, start, end):
+        # type: (str, datetime, datetime) -> List[Programme]
+        """Programmes of a channel between two UTC times, answered from the EPG store."""
+        return [Programme.from_dict(p) for p in self.store.programmes(str(channel_id), timestamp(start),
+                                                                         timestamp(end))]
+
+    def now_next(self, at=None):
+        # type: (datetime or None) -> Dict[str, Dict[str, Programme or None]]
+        """Currently airing and following programme of every channel, answered from the EPG store."""
+        data = self.store.now_next(timestamp(at or datetime.utcnow()))
+        return {channel: {k: Programme.from_dict(p) if p else None for k, p in v.items()}
+                for channel, v in data.items()}
 
-        days = int((to_date - from_date).days)
-
-        for n in range(days):
-            current_day = from_date + timedelta(n)
-            time_filter = 'startTime=ge=%sT00:00:00.000Z;startTime=le=%sT00:59:59.999Z' % (
-                current_day.strftime("%Y-%m-%d"), (current_day + timedelta(days=1)).strftime("%Y-%m-%d"))
-
-            fetch_more = True
-            offset = 0
-            while fetch_more:
-                resp = self._get('https://skgo.magio.tv/v2/television/epg',
-                                 params={'filter': time_filter, 'limit': '100', 'offset': offset * 20, 'list': 'LIVE'},
-                                 headers=self._auth_headers())
-
-                fetch_more = len(resp['items']) == 100
-                offset = offset + 1
-
-                for i in resp['items']:
-                    for p in i['programs']:
-                        channel = str(p['channel']['id'])
-
-                        if channel not in channels:
-                            continue
-
-                        if channel not in ret:
-                            ret[channel] = []
-
-                        programme = self._programme_data(p['program'])
-                        programme.start_time = datetime.utcfromtimestamp(p['startTimeUTC'] / 1000)
-                        programme.end_time = datetime.utcfromtimestamp(p['endTimeUTC'] / 1000)
-                        programme.duration = p['duration']
-                        programme.is_replyable = (programme.start_time > (now - timedelta(days=7))) and (
-                                programme.end_time < now)
-
-                        ret[channel].append(programme)
-
+    def _epg(self, channels, from_date, to_date):
+        ret = {}
+        for day, programmes in self._iter_epg(channels, from_date, to_date):
+            for channel, items in programmes.items():
+                ret.setdefault(channel, []).extend(items)
         return ret
 
     def _access(self):
-        self._post('https://skgo.magio.tv/v2/auth/init',
-                   params={'dsid': 'Netscape.' + str(int(time.time())) + '.' + str(random.random()),
-                           'deviceName': 'TV',
+        # the same device id on every init, a new one would take another device slot
+        dsid = self._session.device_id(lambda: 'Netscape.' + str(int(time.time())) + '.' + str(random.random()))
+        self._post(self.base_url + '/v2/auth/init',
+                   params={'dsid': dsid,
+                           'deviceName': DEVICE_NAME,
                            'deviceType': 'OTT_ANDROID',
                            'osVersion': '0.0.0',
                            'appVersion': '0.0.0',
@@ -204,17 +550,24 @@ class Magio:
                             'Sec-Fetch-Mode': 'cors', 'Sec-Fetch-Site': 'cross-site'})
 
     def devices(self):
+        # type: () -> List[MagioGoDevice]
+        return self._lookups.get('devices', self._load_devices, self.devices_ttl)
+
+    def _load_devices(self):
         # type: () -> List[MagioGoDevice]
         def make_device(i, is_this):
             device = MagioGoDevice()
             device.id = str(i['id'])
             device.name = i['name']
-            device.expiration_time = self._strptime(i['verimatrixExpirationTime'], "%Y-%m-%dT%H:%M:%S.%fZ")
+            expiration = i['verimatrixExpirationTime']
+            if expiration:
+                device.expiration_time = datetime.strptime(expiration, '%Y-%m-%dT%H:%M:%S.%fZ')
             device.is_this = is_this
             return device
 
-        self._login()
-        resp = self._get('https://skgo.magio.tv/home/listDevices', headers=self._auth_headers())
+        # devices are listed to free a slot after a failed login, that must not try to free one again
+        self._login(evict=False)
+        resp = self._get(self.base_url + '/home/listDevices', headers=self._auth_headers())
 
         devices = [make_device(i, False) for i in resp['items']]
 
@@ -222,37 +575,49 @@ class Magio:
             devices.append(make_device(resp['thisDevice'], True))
         return devices
 
-    def _login(self):
-        self._load_session(self._data)
+    def _login(self, evict=True):
+        if not self._session.needs_login() and not self._session.needs_refresh():
+            return
 
-        if not self._data.access_token:
-            self._access()
-            self._post('https://skgo.magio.tv/v2/auth/login',
-                       jsonData={'loginOrNickname': self.user, 'password': self.password},
-                       headers=self._auth_headers())
+        try:
+            with self._session.exclusive():
+                if self._session.needs_login():
+                    self._access()
+                    self._auth_request('/v2/auth/login', {'loginOrNickname': self.user, 'password': self.password})
+
+                if self._session.needs_refresh():
+                    self._auth_request('/v2/auth/tokens', {'refreshToken': self._data.refresh_token})
+        except MagioGoException as e:
+            # a device is freed only once the login lock is released, listing the devices logs in again
+            if not evict or not self._is_max_device_limit(e):
+                raise
+            self._login(evict=False)
 
-        if self._data.refresh_token and self._data.expires_in < int(time.time() * 1000):
-            self._post('https://skgo.magio.tv/v2/auth/tokens',
-                       jsonData={'refreshToken': self._data.refresh_token},
-                       headers=self._auth_headers())
+    def _auth_request(self, path, payload):
+        try:
+            resp = self._send('POST', self.base_url + path, json=payload, headers=self._auth_headers())
+        except requests.exceptions.ConnectionError as err:
+            raise ConnectionError(str(err))
+        self._check_response(resp)
 
     def _post(self, url, data=None, jsonData=None, **kwargs):
         try:
-            resp = self._request().post(url, data=data, json=jsonData, **kwargs).json()
+            resp = self._send('POST', url, data=data, json=jsonData, **kwargs)
             self._check_response(resp)
             return resp
         except requests.exceptions.ConnectionError as err:
             raise ConnectionError(str(err))
         except MagioGoException as e:
             if self._is_max_device_limit(e):
-                resp = self._request().post(url, data=data, json=jsonData, **kwargs).json()
+                resp = self._send('POST', url, data=data, json=jsonData, **kwargs)
                 self._check_response(resp)
                 return resp
 
     def disconnect_device(self, device_id):
         # type: (str) -> None
-        self._login()
-        self._get('https://skgo.magio.tv/home/deleteDevice', params={'id': device_id}, headers=self._auth_headers())
+        self._login(evict=False)
+        self._get(self.base_url + '/home/deleteDevice', params={'id': device_id}, headers=self._auth_headers())
+        self._lookups.invalidate('devices')
 
 
     def _auth_headers(self):
@@ -263,136 +628,200 @@ class Magio:
     def _check_response(self, resp):
         if resp['success']:
             if 'token' in resp:
-                self._data.access_token = resp['token']['accessToken']
-                self._data.refresh_token = resp['token']['refreshToken']
-                self._data.expires_in = resp['token']['expiresIn']
-                self._data.type = resp['token']['type']
-                self._store_session(self._data)
+                self._session.update(resp['token']['accessToken'], resp['token']['refreshToken'],
+                                     resp['token']['expiresIn'], resp['token']['type'])
         else:
-            self._store_session(SessionData())
+            self._session.clear()
+            code = str(resp.get('errorCode') or '')
+            if SESSION_ERROR.search(code):
+                # cached stream urls and devices belong to the session the API has just rejected
+                self._lookups.invalidate()
+            elif code == 'DEVICE_MAX_LIMIT':
+                self._lookups.invalidate('devices')
             raise MagioGoException(str(resp['errorMessage']), resp['errorCode'])
 
+    @staticmethod
+    def _evictable(devices):
+        # type: (List[MagioGoDevice]) -> List[MagioGoDevice]
+        """Other devices, least recently used first, devices registered by this client before any other."""
+        return sorted((d for d in devices if not d.is_this),
+                      key=lambda d: (d.name != DEVICE_NAME, d.expiration_time or datetime.min))
+
+    def _evict_device(self, devices, reason):
+        # type: (List[MagioGoDevice], str) -> bool
+        evictable = self._evictable(devices)
+        if not evictable:
+            return False
+        self.disconnect_device(evictable[0].id)
+        DEVICE_EVICTIONS.inc(reason=reason)
+        return True
+
+    def ensure_device_slot(self):
+        # type: () -> bool
+        """
+        Removes the least recently used device when the account's devices fill its quota and this client is not
+        among them, before a stream request would fail with DEVICE_MAX_LIMIT. Returns whether one was removed.
+        """
+        if not self.device_quota:
+            return False
+        devices = self.devices()
+        if any(d.is_this for d in devices) or len(devices) < self.device_quota:
+            return False
+        return self._evict_device(devices, 'quota')
+
     def _is_max_device_limit(self, e):
         if e.code == 'DEVICE_MAX_LIMIT':
-            device = min([d for d in self.devices() if not d.is_this])
-            self.disconnect_device(device.id)
-            return True
+            devices = self.devices()
+            if not self.device_quota:
+                self.device_quota = len([d for d in devices if not d.is_this])
+            return self._evict_device(devices, 'limit')
         return False
 
     def _get(self, url, params=None, **kwargs):
         try:
-            resp = self._request().get(url, params=params, **kwargs).json()
+            resp = self._send('GET', url, params=params, **kwargs)
             self._check_response(resp)
             return resp
         except requests.exceptions.ConnectionError as err:
             raise ConnectionError(str(err))
         except MagioGoException as e:
             if self._is_max_device_limit(e):
-                resp = self._request().get(url, params=params, **kwargs).json()
+                resp = self._send('GET', url, params=params, **kwargs)
                 self._check_response(resp)
                 return resp
 
-    def _programme_data(self, pi):
-        def safe_int(value, default=None):
-            try:
-                return int(value)
-            except (ValueError, TypeError):
-                return default
+    def _send(self, method, url, **kwargs):
+        # type: (str, str, ...) -> dict
+        endpoint = urlparse(url).path
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            r = self._request().request(method, url, **kwargs)
+            status = str(r.status_code)
+            retries = getattr(r.raw, 'retries', None)
+            if retries is not None and retries.history:
+                API_RETRIES.inc(len(retries.history), method=method, endpoint=endpoint)
+            API_BYTES.inc(len(r.content), method=method, endpoint=endpoint)
+            return r.json()
+        finally:
+            duration = time.perf_counter() - started
+            API_REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+            API_LATENCY.observe(duration, method=method, endpoint=endpoint)
+            if self.trace is not None:
+                self.trace.add('request', started, duration, method=method, endpoint=endpoint, status=status)
 
+    @staticmethod
+    def _programme_data(pi):
         programme = Programme()
         programme.id = pi['programId']
         programme.title = pi['title']
         programme.description = pi['description']
 
         pv = pi['programValue']
-        if pv['episodeId'] is not None:
-            programme.episodeNo = safe_int(pv['episodeId'])
-        if pv['seasonNumber'] is not None:
-            programme.seasonNo = safe_int(pv['seasonNumber'])
-        if pv['creationYear'] is not None:
-            programme.year = safe_int(pv['creationYear'])
-        for i in pi['images']:
-            programme.thumbnail = i
-            break
-        for i in pi['images']:
-            if "_VERT" in i:
-                programme.poster = i
-                break
-        for d in pi['programRole']['directors']:
-            programme.directors.append(d['fullName'])
-        for a in pi['programRole']['actors']:
-            programme.actors.append(a['fullName'])
-        if pi['programCategory'] is not None:
-            for c in pi['programCategory']['subCategories']:
-                programme.genres.append(c['desc'])
+        value = pv['episodeId']
+        if value is not None:
+            programme.episodeNo = _int(value)
+        value = pv['seasonNumber']
+        if value is not None:
+            programme.seasonNo = _int(value)
+        value = pv['creationYear']
+        if value is not None:
+            programme.year = _int(value)
+
+        # the first image is the thumbnail, the first vertical one the poster
+        images = pi['images']
+        if images:
+            programme.thumbnail = images[0]
+            for image in images:
+                if '_VERT' in image:
+                    programme.poster = image
+                    break
+
+        roles = pi['programRole']
+        people = roles['directors']
+        if people:
+            programme.directors = tuple([intern(d['fullName']) for d in people])
+        people = roles['actors']
+        if people:
+            programme.actors = tuple([intern(a['fullName']) for a in people])
+        category = pi['programCategory']
+        if category is not None and category['subCategories']:
+            programme.genres = tuple([intern(c['desc']) for c in category['subCategories']])
 
         return programme
 
     def create_epg(self, file_name, epg):
-        with open(file_name, 'w', encoding='utf8') as file:
-            file.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n')
-            file.write('<tv>\n')
-
+        with XmltvWriter(file_name) as writer:
             for channel_id in epg:
-                file.write('<channel id="%s">\n' % channel_id)
-                file.write('</channel>\n')
+                writer.write_channel(channel_id)
 
             for channel_id in epg:
                 for p in epg[channel_id]:
-                    file.write('<programme channel="%s" start="%s" stop="%s">\n' % (
-                        channel_id, p.start_time.strftime('%Y%m%d%H%M%S'), p.end_time.strftime('%Y%m%d%H%M%S')))
-                    if p.title:
-                        file.write('<title>%s</title>\n' % html_escape(p.title))
-                    if p.description:
-                        file.write('<desc>%s</desc>\n' % html_escape(p.description))
-                    if p.thumbnail:
-                        file.write('<icon src="%s"/>\n' % html_escape(p.thumbnail))
-                    if p.genres:
-                        file.write('<category>%s</category>\n' % html_escape(', '.join(p.genres)))
-                    if p.actors or p.directors or p.writers or p.producers:
-                        file.write('<credits>\n')
-                        for actor in p.actors:
-                            file.write('<actor>%s</actor>\n' % html_escape(actor))
-                        for director in p.directors:
-                            file.write('<director>%s</director>\n' % html_escape(director))
-                        for writer in p.writers:
-                            file.write('<writer>%s</writer>\n' % html_escape(writer))
-                        for producer in p.producers:
-                            file.write('<producer>%s</producer>\n' % html_escape(producer))
-                        file.write('</credits>\n')
-                    if p.seasonNo and p.episodeNo:
-                        file.write(
-                            '<episode-num system="xmltv_ns">%d.%d.</episode-num>\n' % (p.seasonNo - 1, p.episodeNo - 1))
-                    file.write('</programme>\n')
-            file.write('</tv>\n')
+                    writer.write_programme(channel_id, p)
 
     def _request(self):
-        session = requests.Session()
-        session.mount('https://',
-                      HTTPAdapter(
-                          max_retries=Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])))
-        return session
+        return self._http.session()
 
-    @staticmethod
-    def _strptime(date_string, format):
-        # https://forum.kodi.tv/showthread.php?tid=112916 it's insane !!!
+    def connection_stats(self):
+        return self._http.stats()
+
+    def warm_up(self):
+        """Logs in and loads the channel list ahead of the first request."""
+        self._login()
+        self.get_channels()
+        # processes forked after the warm-up must not share the pooled connections
+        self._http.close()
+
+    def generate(self, output, progress=None):
+        # progress(phase, done, total) is called as the generation advances
+        progress = progress or (lambda phase, done=0, total=0: None)
+        self.stats = PipelineStats()
+        self.stats.reset_peak_memory()
+        self.trace = Trace('epg')
         try:
-            return datetime.strptime(date_string, format)
-        except TypeError:
-            import time as ptime
-            return datetime(*(ptime.strptime(date_string, format)[0:6]))
+            self._generate(output, progress)
+        except BaseException:
+            EPG_GENERATIONS.inc(result='failed')
+            raise
+        else:
+            EPG_GENERATIONS.inc(result='done')
+        finally:
+            trace, self.trace = self.trace, None
+            for phase, duration in trace.phases.items():
+                EPG_PHASES.observe(duration, phase=phase)
+            if self.trace_dir:
+                trace.save(self.trace_dir)
+        print("Done: %r %s" % (self.stats, ' '.join('%s=%.2fs' % p for p in trace.phases.items())))
+
+        return True
 
-    def generate(self, output):
+    def _generate(self, output, progress):
         print("Fetching channels")
-        channels = self._load_channels()
+        progress('channels')
+        with self._phase('channels'):
+            channels = self.lineup.select(self._load_channels())
         print("Found " + str(len(channels)) + " channels")
 
-        print("Fetching EPG")
-        now = datetime.now()
-        data = self._epg(channels.keys(), now - timedelta(days=self.from_days),
-                         now + timedelta(days=self.to_days))
-
-        print("Building XMLTV file")
-        self.create_epg(output, data)
-
-        return True
+        print("Fetching EPG and building XMLTV file")
+        # EPG days are UTC days, like the day filter of the API and the cache's notion of today
+        now = datetime.utcnow()
+        days = self.from_days + self.to_days + 1
+        counts = {str(channel_id): 0 for channel_id in channels}
+        progress('epg', 0, days)
+        with XmltvWriter(output) as writer:
+            with self._phase('write'):
+                for channel_id in channels:
+                    writer.write_channel(channel_id)
+
+            for n, (day, programmes) in enumerate(self._iter_epg(channels.keys(), now - timedelta(days=self.from_days),
+                                                                 now + timedelta(days=self.to_days))):
+                with self._phase('write', day=day.strftime('%Y-%m-%d')):
+                    for channel_id, items in programmes.items():
+                        for p in items:
+                            writer.write_programme(channel_id, p)
+                        counts[channel_id] = counts.get(channel_id, 0) + len(items)
+                self.stats.written = writer.programmes
+                progress('epg', n + 1, days)
+
+        self.stats.update_peak_memory()
+        EPG_PROGRAMMES.replace({(channel_id,): count for channel_id, count in counts.items()})
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# upper bounds in seconds of latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, description, labels=()):
+        # type: (str, str, Tuple[str, ...]) -> None
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}  # type: Dict[Tuple[str, ...], object]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        # type: () -> List[str]
+        with self._lock:
+            return ['%s%s %s' % (self.name, _labels(self.labels, key), _number(value))
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        # type: () -> List[str]
+        return ['# HELP %s %s' % (self.name, self.description), '# TYPE %s %s' % (self.name, self.kind)] + \
+            self._samples()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        # type: (str, str, Tuple[str, ...], Callable[[], object] or None) -> None
+        super().__init__(name, description, labels)
+        # evaluated on every render, for values which are cheaper to read than to track, returns the value
+        # or a dict of values by label value tuples
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, values):
+        # type: (Dict[Tuple[str, ...], float]) -> None
+        """Replaces all label sets at once, label sets missing in `values` disappear."""
+        with self._lock:
+            self._values = dict(values)
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = None
+            if isinstance(value, dict):
+                self.replace(value)
+            elif value is not None:
+                self.set(value)
+        return super()._samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append('%s_bucket%s %d' % (self.name, _labels(self.labels, key, [('le', _number(bound))]),
+                                                     count))
+                lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, key), repr(total)))
+                lines.append('%s_count%s %d' % (self.name, _labels(self.labels, key), counts[-1]))
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}  # type: Dict[str, Metric]
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # modules may be imported more than once, e.g. by the Django autoreloader
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        # type: (str, str, Tuple[str, ...]) -> Counter
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=(), function=None):
+        # type: (str, str, Tuple[str, ...], Callable[[], object] or None) -> Gauge
+        return self._register(Gauge(name, description, labels, function))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        # type: (str, str, Tuple[str, ...], Tuple[float, ...]) -> Histogram
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        # type: () -> str
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    """
+    Timeline of one EPG generation run.
+
+    Spans are recorded from any thread, phases additionally sum up their durations, so interleaved phases
+    like fetching and parsing of consecutive days can be told apart. `save` writes the run as JSON.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.spans = []  # type: List[dict]
+        self.phases = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration, **attributes):
+        # type: (str, float, float, ...) -> None
+        """Adds a span, `started` is a perf_counter value."""
+        span = {'name': name, 'start': round(started - self._started, 6), 'duration': round(duration, 6),
+                'thread': threading.current_thread().name}
+        span.update(attributes)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def phase(self, name, **attributes):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + duration
+            self.add(name, started, duration, **attributes)
+
+    def to_dict(self):
+        with self._lock:
+            return {'name': self.name, 'started_at': self.started_at,
+                    'duration': round(time.perf_counter() - self._started, 6),
+                    'phases': {k: round(v, 6) for k, v in self.phases.items()}, 'spans': list(self.spans)}
+
+    def save(self, directory):
+        # type: (str) -> str
+        os.makedirs(directory, exist_ok=True)
+        file_name = os.path.join(directory, '%s-%s.%03d.json' % (
+            self.name, time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started_at)), self.started_at % 1 * 1000))
+        tmp = file_name + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp, file_name)
+        return file_name
@@ -0,0 +1,28 @@
+from typing import Callable, Dict
+
+
+def _attribute(value):
+    # M3U attributes have no escaping, quotes and line breaks would end them
+    return str(value).replace('"', "'").replace('\r', ' ').replace('\n', ' ')
+
+
+def m3u(channels, stream_url, epg_url=None, groups=None):
+    # type: (Dict[int, object], Callable[[int], str], str or None, Dict[int, str] or None) -> str
+    """
+    Extended M3U playlist of `channels`, `stream_url(channel_id)` gives the url a player opens.
+
+    `tvg-id` is the channel id used in the XMLTV guide at `epg_url`, `groups` maps channel ids to `group-title`.
+    """
+    groups = groups or {}
+    lines = ['#EXTM3U url-tvg="%s"' % _attribute(epg_url) if epg_url else '#EXTM3U']
+    for channel_id, channel in channels.items():
+        attributes = 'tvg-id="%s" tvg-name="%s"' % (channel_id, _attribute(channel.name))
+        if channel.logo:
+            attributes += ' tvg-logo="%s"' % _attribute(channel.logo)
+        if channel_id in groups:
+            attributes += ' group-title="%s"' % _attribute(groups[channel_id])
+        if channel.archive_days:
+            attributes += ' catchup-days="%d"' % channel.archive_days
+        lines.append('#EXTINF:-1 %s,%s' % (attributes, channel.name.replace('\n', ' ')))
+        lines.append(stream_url(channel_id))
+    return '\n'.join(lines) + '\n'
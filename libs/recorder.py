@@ -1,27 +1,134 @@
 import os
+import threading
+import time
 from datetime import datetime
 
 import ffmpeg
 import logging
 
+from libs.ffmpegSupervisor import FfmpegProcess
+
 cmd = os.environ.get('FFMPEG_PATH')
 
+# let ffmpeg pick codecs for the output file, may transcode
+MODE_AUTO = 'auto'
+# remux the stream into one .ts file without transcoding
+MODE_COPY = 'copy'
+# remux the stream into HLS segments without transcoding, finished segments survive a crash
+MODE_SEGMENT = 'segment'
+
 
 class Recorder:
-    def __init__(self, url: str, duration: float):
+    def __init__(self, url: str, duration: float, mode: str = MODE_COPY, output_dir: str = 'data',
+                 segment_time: int = 10, segment_list_size: int = 0, url_provider=None, stall_timeout: int = 30,
+                 max_restarts: int = 5):
         self.stream = url
         self.duration = duration
+        self.mode = mode
+        self.output_dir = output_dir
+        # length of one HLS segment in seconds
+        self.segment_time = segment_time
+        # number of segments kept on disk, older ones are deleted, 0 keeps all
+        self.segment_list_size = segment_list_size
+        # returns a fresh stream url when ffmpeg fails or stalls, e.g. because the url expired
+        self.url_provider = url_provider
+        # seconds without the output growing or its media time advancing after which ffmpeg is restarted
+        self.stall_timeout = stall_timeout
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self._recorded = 0.0
+        self._written = 0
+        self._process = None  # type: FfmpegProcess or None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def _output(self, name, duration, part):
+        options = {'t': duration}
+        suffix = '' if part == 1 else '.part%d' % part
+        if self.mode == MODE_AUTO:
+            return os.path.join(self.output_dir, name + suffix + '.ts'), options
+
+        options['c'] = 'copy'
+        if self.mode == MODE_COPY:
+            options['f'] = 'mpegts'
+            return os.path.join(self.output_dir, name + suffix + '.ts'), options
+
+        directory = os.path.join(self.output_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        options.update({'f': 'hls', 'hls_time': self.segment_time, 'hls_list_size': self.segment_list_size,
+                        'hls_segment_filename': os.path.join(directory, '%06d.ts')})
+        flags = []
+        if self.segment_list_size:
+            flags.append('delete_segments')
+        else:
+            options['hls_playlist_type'] = 'event'
+        if part > 1:
+            # continue the playlist and segment numbering of the previous run
+            flags.append('append_list')
+        if flags:
+            options['hls_flags'] = '+'.join(flags)
+        return os.path.join(directory, 'index.m3u8'), options
+
+    def _supervise(self, process):
+        # type: (FfmpegProcess) -> bool
+        while True:
+            time.sleep(1)
+            if process.poll() is not None:
+                return False
+            if process.stalled_for() > self.stall_timeout:
+                logging.error('ffmpeg stalled for %ds, restarting' % process.stalled_for())
+                process.terminate()
+                return True
+
+    def start(self, output: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = output + datetime.strftime(datetime.now(), '%s')
+        result = None
+        part = 1
+        while True:
+            remaining = self.duration * 60 - self._recorded
+            path, options = self._output(name, remaining, part)
+            result = result or path
+            process = FfmpegProcess(ffmpeg.input(self.stream).output(path, **options).compile(cmd=cmd or 'ffmpeg'))
+            with self._lock:
+                if self._stopped:
+                    return result
+                self._process = process
+                process.start()
+
+            stalled = self._supervise(process)
+            returncode = process.wait()
+            self._recorded += process.out_time
+            self._written += process.total_size
+
+            if self._stopped:
+                return result
+            remaining = self.duration * 60 - self._recorded
+            if (stalled or returncode) and remaining > 1 and self.url_provider is not None \
+                    and self.restarts < self.max_restarts:
+                self.restarts += 1
+                part += 1
+                self.stream = self.url_provider()
+                continue
+            if returncode:
+                log = '\n'.join(process.log)
+                logging.error(log)
+                raise ffmpeg.Error('ffmpeg', b'', log.encode('utf8'))
+            return result
+
+    def progress(self):
+        process = self._process
+        recorded, written, bitrate, speed, log = self._recorded, self._written, '', '', []
+        if process is not None and process.poll() is None:
+            recorded += process.out_time
+            written += process.total_size
+            bitrate, speed, log = process.bitrate, process.speed, list(process.log)[-10:]
+        return {'recorded': recorded, 'bytes': written, 'bitrate': bitrate, 'speed': speed,
+                'restarts': self.restarts, 'log': log}
 
-    def start(self, output: str):
-        try:
-            output = 'data/' + output + datetime.strftime(datetime.now(), '%s') + '.ts'
-            (
-                ffmpeg.input(self.stream)
-                .output(output, **{'t': self.duration * 60})
-                .run(capture_stdout=True, capture_stderr=True, **(dict(cmd=cmd) if cmd is not None else dict()))
-            )
-        except ffmpeg.Error as e:
-            print('stdout:', e.stdout.decode('utf8'))
-            print('stderr:', e.stderr.decode('utf8'))
-            logging.error(e.stderr.decode('utf8'))
-            raise e
+    def stop(self):
+        # ffmpeg finishes the output file properly on SIGTERM
+        with self._lock:
+            self._stopped = True
+            if self._process is not None:
+                self._process.terminate()
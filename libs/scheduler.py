@@ -0,0 +1,372 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from libs.metrics import REGISTRY
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    start_at INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    output TEXT,
+    error TEXT,
+    created_at INTEGER NOT NULL,
+    started_at INTEGER,
+    finished_at INTEGER,
+    programme_id INTEGER,
+    padding_before INTEGER NOT NULL DEFAULT 0,
+    padding_after INTEGER NOT NULL DEFAULT 0,
+    account INTEGER,
+    heartbeat_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, start_at);
+'''
+
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+DONE = 'done'
+FAILED = 'failed'
+
+RECORDINGS = REGISTRY.counter('magio_recordings_total', 'Recordings finished by this process by status', ('status',))
+
+
+class RecordingJob:
+    def __init__(self, row):
+        # type: (sqlite3.Row) -> None
+        self.id = row['id']  # type: int
+        self.channel_id = row['channel_id']  # type: int
+        self.name = row['name']
+        # recording start as epoch seconds
+        self.start_at = row['start_at']  # type: int
+        # recording length in minutes
+        self.duration = row['duration']  # type: float
+        self.status = row['status']
+        self.owner = row['owner']
+        self.output = row['output']
+        self.error = row['error']
+        self.created_at = row['created_at']
+        self.started_at = row['started_at']
+        self.finished_at = row['finished_at']
+        # EPG programme the recording was scheduled from, its times are followed on EPG refreshes
+        self.programme_id = row['programme_id']  # type: int or None
+        # seconds recorded before the programme start and after its end
+        self.padding_before = row['padding_before']  # type: int
+        self.padding_after = row['padding_after']  # type: int
+        # index of the account recording it, set when the job is claimed
+        self.account = row['account']  # type: int or None
+        # last time the owner said it is still recording, as epoch seconds
+        self.heartbeat_at = row['heartbeat_at']  # type: int or None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class RecordingScheduler:
+    """
+    Persistent queue of recordings executed by a bounded pool of ffmpeg workers.
+
+    Jobs live in SQLite, so every web worker process may run a scheduler: a job is claimed by exactly one
+    of them and at most `max_workers` recordings run at once across all of them. `make_recorder(job)`
+    returns a Recorder whose `start(name)` blocks until the recording ends and `stop()` interrupts it,
+    `finished(job)` is then called whatever the outcome, e.g. to give back what the recorder was made with.
+    `assign_account(recordings)` picks the account of a job being claimed from the number of recordings running
+    on each account in all processes, it is stored as `job.account`.
+
+    The owner refreshes the heartbeat of its recordings every poll, a recording whose heartbeat is older than
+    `stale_after` seconds is failed by any scheduler, so one left by a container that is gone does not hold a
+    worker slot for good.
+    """
+
+    def __init__(self, file_name, make_recorder, max_workers=2, poll_interval=5, finished=None, assign_account=None,
+                 stale_after=None):
+        # type: (str, Callable, int, float, Optional[Callable], Optional[Callable], Optional[float]) -> None
+        self.file_name = file_name
+        self.make_recorder = make_recorder
+        self.finished = finished
+        self.assign_account = assign_account
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after or max(12 * poll_interval, 60)
+        self.owner = '%s:%d' % (socket.gethostname(), os.getpid())
+        self._recorders = {}  # type: Dict[int, object]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.file_name, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def schedule(self, channel_id, name, duration, start_at=None):
+        # type: (int, str, float, Optional[float]) -> int
+        now = int(time.time())
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (channel_id, name, start_at, duration, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (channel_id, name, int(start_at or now), duration, QUEUED, now))
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def schedule_programme(self, programme, padding_before=0, padding_after=0):
+        # type: (dict, int, int) -> int
+        """
+        Schedules recording of an EPG store programme, `padding_*` are in seconds. A programme already on air
+        is recorded from now on, an ended one raises ValueError.
+        """
+        return self.schedule_programmes([programme['id']], lambda _: programme, padding_before, padding_after)[0]
+
+    def schedule_programmes(self, programme_ids, find_programme, padding_before=0, padding_after=0):
+        # type: (List[int], Callable[[int], Optional[dict]], int, int) -> List[int]
+        """
+        Schedules several programmes like `schedule_programme`, all or none of them: an unknown programme raises
+        KeyError and an ended one ValueError before any is scheduled.
+        """
+        now = int(time.time())
+        rows = []
+        for programme_id in programme_ids:
+            programme = find_programme(programme_id)
+            if programme is None:
+                raise KeyError(programme_id)
+            start_at, duration = _programme_window(programme, padding_before, padding_after, now)
+            if duration <= 0:
+                raise ValueError('Programme %s has already ended' % programme['id'])
+            rows.append((int(programme['channel']), programme['name'], start_at, duration, QUEUED, now,
+                         programme['id'], padding_before, padding_after))
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            ids = [conn.execute('INSERT INTO jobs (channel_id, name, start_at, duration, status, created_at, '
+                                'programme_id, padding_before, padding_after) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                row).lastrowid for row in rows]
+            conn.execute('COMMIT')
+        self._wakeup.set()
+        return ids
+
+    def reschedule(self, find_programme):
+        # type: (Callable[[int], Optional[dict]]) -> int
+        """Moves queued programme recordings whose programme times changed, returns how many moved."""
+        moved = 0
+        now = int(time.time())
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT * FROM jobs WHERE status = ? AND programme_id IS NOT NULL',
+                                (QUEUED,)).fetchall()
+            for job in [RecordingJob(r) for r in rows]:
+                programme = find_programme(job.programme_id)
+                if programme is None:
+                    continue
+                start_at, duration = _programme_window(programme, job.padding_before, job.padding_after, now)
+                if duration > 0 and (start_at, duration) != (job.start_at, job.duration):
+                    moved += conn.execute(
+                        'UPDATE jobs SET start_at = ?, duration = ? WHERE id = ? AND status = ?',
+                        (start_at, duration, job.id, QUEUED)).rowcount
+        if moved:
+            self._wakeup.set()
+        return moved
+
+    def job(self, job_id):
+        # type: (int) -> Optional[RecordingJob]
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return RecordingJob(row) if row is not None else None
+
+    def jobs(self, limit=100):
+        # type: (int) -> List[RecordingJob]
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT * FROM jobs ORDER BY start_at DESC LIMIT ?', (limit,)).fetchall()
+        return [RecordingJob(r) for r in rows]
+
+    def running(self):
+        # type: () -> int
+        """Number of recordings running in all processes."""
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (RUNNING, CANCELLING)).fetchone()[0]
+
+    def account_load(self):
+        # type: () -> Dict[int, int]
+        """Recordings running in all processes by account index."""
+        with closing(self._connect()) as conn:
+            return self._account_load(conn)
+
+    @staticmethod
+    def _account_load(conn):
+        return dict(conn.execute('SELECT account, COUNT(*) FROM jobs WHERE status IN (?, ?) AND account IS NOT NULL '
+                                 'GROUP BY account', (RUNNING, CANCELLING)).fetchall())
+
+    def progress(self, job_id):
+        # type: (int) -> Optional[dict]
+        """Live progress of a recording running in this process."""
+        with self._lock:
+            recorder = self._recorders.get(job_id)
+        return recorder.progress() if recorder is not None else None
+
+    def cancel(self, job_id):
+        # type: (int) -> bool
+        """Cancels a queued job or asks the process running it to stop ffmpeg."""
+        with closing(self._connect()) as conn:
+            cancelled = conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                                     (CANCELLED, int(time.time()), job_id, QUEUED)).rowcount
+            stopping = conn.execute('UPDATE jobs SET status = ? WHERE id = ? AND status = ?',
+                                    (CANCELLING, job_id, RUNNING)).rowcount
+        self._wakeup.set()
+        return bool(cancelled or stopping)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='recording')
+        self._thread = threading.Thread(target=self._run, name='recording-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops claiming jobs, recordings already running go on until they end."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self._heartbeat()
+                self._recover()
+                self._stop_cancelled()
+                while self._claim_next():
+                    pass
+            except Exception as e:
+                logging.error('Recording scheduler failed: %s' % e)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _heartbeat(self):
+        with self._lock:
+            recording = list(self._recorders)
+        if not recording:
+            return
+        with closing(self._connect()) as conn:
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND id IN (%s)' % ', '.join(
+                '?' * len(recording)), [int(time.time()), self.owner] + recording)
+
+    def _recover(self):
+        # recordings of processes which died while recording can not be resumed, a dead process on this host is
+        # known at once, one on another host, e.g. a replaced container, once its heartbeat goes stale
+        now = int(time.time())
+        with self._lock:
+            recording = set(self._recorders)
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT id, owner, COALESCE(heartbeat_at, started_at, 0) AS heartbeat_at FROM jobs '
+                                'WHERE status IN (?, ?)', (RUNNING, CANCELLING)).fetchall()
+            for row in rows:
+                if row['owner'] == self.owner and row['id'] in recording:
+                    continue
+                host, _, pid = (row['owner'] or '').rpartition(':')
+                if (host == socket.gethostname() and not _is_alive(int(pid or 0))) or \
+                        row['heartbeat_at'] < now - self.stale_after:
+                    conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN '
+                                 '(?, ?)', (FAILED, 'interrupted', now, row['id'], RUNNING, CANCELLING))
+
+    def _stop_cancelled(self):
+        with self._lock:
+            running = list(self._recorders.items())
+        if not running:
+            return
+        with closing(self._connect()) as conn:
+            cancelling = {r['id'] for r in conn.execute(
+                'SELECT id FROM jobs WHERE status = ? AND owner = ?', (CANCELLING, self.owner))}
+        for job_id, recorder in running:
+            if job_id in cancelling:
+                recorder.stop()
+
+    def _claim_next(self):
+        # type: () -> bool
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            running = conn.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)',
+                                   (RUNNING, CANCELLING)).fetchone()[0]
+            row = conn.execute('SELECT * FROM jobs WHERE status = ? AND start_at <= ? ORDER BY start_at, id LIMIT 1',
+                               (QUEUED, int(time.time()))).fetchone()
+            if row is None or running >= self.max_workers:
+                conn.execute('ROLLBACK')
+                return False
+            try:
+                # chosen within the claim, so workers claiming at the same time see each other's accounts
+                account = self.assign_account(self._account_load(conn)) if self.assign_account else None
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            now = int(time.time())
+            conn.execute('UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = ?, account = ? '
+                         'WHERE id = ?', (RUNNING, self.owner, now, now, account, row['id']))
+            conn.execute('COMMIT')
+
+        job = RecordingJob(row)
+        job.account = account
+        self._executor.submit(self._record, job)
+        return True
+
+    def _record(self, job):
+        # type: (RecordingJob) -> None
+        status, output, error = DONE, None, None
+        try:
+            recorder = self.make_recorder(job)
+            with self._lock:
+                self._recorders[job.id] = recorder
+            output = recorder.start(job.name)
+        except BaseException as e:
+            # also MagioGoException, a job left running under a live owner would hold a worker slot for good
+            logging.error('Recording %d failed: %s' % (job.id, e))
+            status, error = FAILED, str(e)
+        finally:
+            with self._lock:
+                self._recorders.pop(job.id, None)
+            if self.finished is not None:
+                self.finished(job)
+
+        with closing(self._connect()) as conn:
+            if conn.execute('SELECT status FROM jobs WHERE id = ?', (job.id,)).fetchone()[0] == CANCELLING:
+                status = CANCELLED
+            conn.execute('UPDATE jobs SET status = ?, output = ?, error = ?, finished_at = ? WHERE id = ?',
+                         (status, output, error, int(time.time()), job.id))
+        RECORDINGS.inc(status=status)
+        self._wakeup.set()
+
+
+def _programme_window(programme, padding_before, padding_after, now):
+    # what is left of a programme already on air, the duration is not positive once it ended
+    start_at = max(int(programme['start_time']) - padding_before, now)
+    duration = (int(programme['end_time']) + padding_after - start_at) / 60
+    return start_at, duration
+
+
+def _is_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+class SessionData:
+    def __init__(self):
+        self.access_token = ''
+        self.refresh_token = ''
+        self.expires_in = 0
+        self.type = ''
+        # device id sent on auth init, kept across logins so the client keeps using one device slot
+        self.dsid = ''
+
+
+class SessionManager:
+    """
+    Keeps Magio tokens in memory and shares them with other processes through `storage_file`.
+
+    The file is read once and then only under the lock before logging in or refreshing, so a worker picks up
+    tokens another worker already obtained instead of logging in again. It is written atomically and only
+    when the tokens change.
+    """
+
+    def __init__(self, storage_file, refresh_margin=5 * 60):
+        self.storage_file = storage_file
+        # seconds before expiration when the access token gets refreshed
+        self.refresh_margin = refresh_margin
+        self.data = SessionData()
+        self._loaded = False
+        self._lock = threading.RLock()
+        # depth of nested exclusive() calls of the current thread, the file lock is taken by the outermost
+        self._local = threading.local()
+
+    def _load(self):
+        data = SessionData()
+        try:
+            with open(self.storage_file, 'r') as f:
+                data.__dict__.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        self.data = data
+        self._loaded = True
+
+    def _store(self):
+        # unique per thread too, clients of other accounts or tests may share a process
+        tmp = '%s.%d.%d.tmp' % (self.storage_file, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(self.data.__dict__, f)
+        os.replace(tmp, self.storage_file)
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def needs_login(self):
+        self.ensure_loaded()
+        return not self.data.access_token
+
+    def needs_refresh(self):
+        self.ensure_loaded()
+        return bool(self.data.refresh_token) and \
+            self.data.expires_in < int((time.time() + self.refresh_margin) * 1000)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Holds the thread and file lock and re-reads the tokens another process may have stored meanwhile.
+        Re-entrant: a nested call of the same thread neither locks the file again, which would block on the
+        lock it holds itself, nor re-reads it.
+        """
+        with self._lock:
+            depth = getattr(self._local, 'depth', 0)
+            lock_file = None
+            if depth == 0:
+                if fcntl is not None:
+                    lock_file = open(self.storage_file + '.lock', 'a')
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._local.depth = depth + 1
+            try:
+                if depth == 0:
+                    self._load()
+                yield self.data
+            finally:
+                self._local.depth = depth
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def update(self, access_token, refresh_token, expires_in, token_type):
+        with self._lock:
+            data = self.data
+            if (data.access_token, data.refresh_token, data.expires_in, data.type) == \
+                    (access_token, refresh_token, expires_in, token_type):
+                return
+            data = SessionData()
+            data.access_token = access_token
+            data.refresh_token = refresh_token
+            data.expires_in = expires_in
+            data.type = token_type
+            data.dsid = self.data.dsid
+            self.data = data
+            self._store()
+
+    def clear(self):
+        with self._lock:
+            if self.data.access_token or self.data.refresh_token:
+                data = SessionData()
+                data.dsid = self.data.dsid
+                self.data = data
+                self._store()
+            self._loaded = True
+
+    def device_id(self, new_id):
+        # type: (Callable[[], str]) -> str
+        """Stored device id, `new_id()` makes one when there is none yet."""
+        self.ensure_loaded()
+        with self._lock:
+            if not self.data.dsid:
+                self.data.dsid = new_id()
+                self._store()
+            return self.data.dsid
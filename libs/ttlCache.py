@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None  # type: BaseException or None
+
+
+class TtlCache:
+    """
+    Thread safe cache of values which expire after a per-entry TTL, least recently used entries are evicted.
+
+    Concurrent `get` calls of a missing key wait for a single `loader` call instead of calling it each.
+    A `ttl` may also be a function of the loaded value, for values which carry their own expiration.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # lookups which waited for another caller's load
+        self.coalesced = 0
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key, loader, ttl):
+        # type: (Hashable, Callable[[], object], float or Callable[[object], float]) -> object
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.put(key, flight.value, ttl(flight.value) if callable(ttl) else ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def peek(self, key, default=None):
+        """Cached value of `key` without loading it, for callers which load and `put` values on their own."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl):
+        # type: (Hashable, object, float) -> None
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        # type: (Hashable) -> None
+        """Drops one entry, or all of them when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'size': len(self._entries)}
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from typing import List
+
+import requests
+from requests.adapters import Retry
+
+from libs.httpPool import PooledSession
+from libs.xmltv import open_xmltv
+
+CHUNK_SIZE = 256 * 1024
+
+
+class Uploader:
+    """
+    PUTs the EPG file to a list of upload targets.
+
+    The file is streamed from disk, optionally gzip compressed on the fly (`Content-Encoding: gzip`), a `.gz` or
+    `.xz` file is sent as the XML document it holds, a `.gz` one as it is when compressing anyway.
+    failed uploads are retried with exponential backoff and targets which already received a file with
+    the same SHA-256 are skipped. Hashes of successful uploads are kept in `state_file`.
+    """
+
+    def __init__(self, targets, state_file, compress=False, retries=4, backoff=1.0, timeout=60):
+        # type: (List[str], str, bool, int, float, float) -> None
+        self.targets = targets
+        self.state_file = state_file
+        self.compress = compress
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # retries are done here, a streamed body can not be replayed by urllib3
+        self._http = PooledSession(pool_size=2, retry=Retry(total=0, raise_on_status=False))
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_state(self, state):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    @staticmethod
+    def _hash(file_name):
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _chunks(file_name):
+        with open_xmltv(file_name) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    @classmethod
+    def _gzip_chunks(cls, file_name):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in cls._chunks(file_name):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _put(self, target, file_name):
+        if self.compress:
+            if file_name.endswith('.gz'):
+                with open(file_name, 'rb') as f:
+                    return self._http.session().put(target, data=f, timeout=self.timeout,
+                                                    headers={'Content-Encoding': 'gzip'})
+            return self._http.session().put(target, data=self._gzip_chunks(file_name), timeout=self.timeout,
+                                            headers={'Content-Encoding': 'gzip'})
+        if file_name.endswith(('.gz', '.xz')):
+            return self._http.session().put(target, data=self._chunks(file_name), timeout=self.timeout)
+        with open(file_name, 'rb') as f:
+            return self._http.session().put(target, data=f, timeout=self.timeout)
+
+    def _upload(self, target, file_name):
+        # type: (str, str) -> bool
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                r = self._put(target, file_name)
+            except requests.exceptions.RequestException as e:
+                logging.error('Uploading to %s failed: %s' % (target, e))
+                continue
+            if r.status_code == 200:
+                return True
+            logging.error('Uploading to %s failed with status %d' % (target, r.status_code))
+            if r.status_code < 500:
+                return False
+        return False
+
+    def upload(self, file_name):
+        # type: (str) -> dict
+        """Uploads the file to every target, returns 'uploaded', 'skipped' or 'failed' per target."""
+        digest = self._hash(file_name)
+        state = self._load_state()
+        result = {}
+        for target in self.targets:
+            if state.get(target) == digest:
+                result[target] = 'skipped'
+                continue
+            if self._upload(target, file_name):
+                state[target] = digest
+                self._store_state(state)
+                result[target] = 'uploaded'
+            else:
+                result[target] = 'failed'
+        return result
@@ -0,0 +1,150 @@
+import gzip
+import io
+import lzma
+import os
+import re
+
+html_escape_table = {
+    "&": "&amp;",
+    '"': "&quot;",
+    "'": "&apos;",
+    ">": "&gt;",
+    "<": "&lt;",
+}
+
+_escape_translation = str.maketrans(html_escape_table)
+_needs_escape = re.compile('[&"\'<>]').search
+
+
+def html_escape(text):
+    # most titles and descriptions contain nothing to escape
+    if _needs_escape(text) is None:
+        return text
+    return text.translate(_escape_translation)
+
+
+def open_xmltv(file_name):
+    """Opens an XMLTV file for reading bytes of the XML document, decompressing a `.gz` or `.xz` one."""
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rb')
+    if file_name.endswith('.xz'):
+        return lzma.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+class XmltvWriter:
+    """
+    Writes an XMLTV file incrementally, one programme at a time.
+
+    Output is buffered and goes to a temporary file which replaces `file_name` only once the document
+    is complete. A `.gz` or `.xz` file name compresses the output while it is being written.
+    Without a file name the document is kept in memory and available as `value` after closing.
+    """
+
+    def __init__(self, file_name=None, buffer_size=256 * 1024):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.programmes = 0
+        self.value = None
+        self._file = None
+        self._tmp_name = None
+        self._buffer = []
+        self._buffered = 0
+        self._times = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _open_file(self, file_name):
+        if self.file_name.endswith('.gz'):
+            return gzip.open(file_name, 'wt', encoding='utf8', compresslevel=6)
+        if self.file_name.endswith('.xz'):
+            return lzma.open(file_name, 'wt', encoding='utf8', preset=3)
+        return open(file_name, 'w', encoding='utf8', buffering=self.buffer_size)
+
+    def open(self):
+        if self.file_name is None:
+            self._file = io.StringIO()
+        else:
+            self._tmp_name = self.file_name + '.tmp'
+            self._file = self._open_file(self._tmp_name)
+        self._write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<tv>\n')
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def _time(self, value):
+        # programmes of different channels share most of their start and stop times
+        formatted = self._times.get(value)
+        if formatted is None:
+            formatted = '%04d%02d%02d%02d%02d%02d' % (
+                value.year, value.month, value.day, value.hour, value.minute, value.second)
+            if len(self._times) > 100000:
+                self._times.clear()
+            self._times[value] = formatted
+        return formatted
+
+    def write_channel(self, channel_id):
+        self._write('<channel id="%s">\n</channel>\n' % channel_id)
+
+    def write_programme(self, channel_id, p):
+        parts = ['<programme channel="%s" start="%s" stop="%s">\n' % (
+            channel_id, self._time(p.start_time), self._time(p.end_time))]
+        if p.title:
+            parts.append('<title>%s</title>\n' % html_escape(p.title))
+        if p.description:
+            parts.append('<desc>%s</desc>\n' % html_escape(p.description))
+        if p.thumbnail:
+            parts.append('<icon src="%s"/>\n' % html_escape(p.thumbnail))
+        if p.genres:
+            parts.append('<category>%s</category>\n' % html_escape(', '.join(p.genres)))
+        if p.actors or p.directors or p.writers or p.producers:
+            parts.append('<credits>\n')
+            for actor in p.actors:
+                parts.append('<actor>%s</actor>\n' % html_escape(actor))
+            for director in p.directors:
+                parts.append('<director>%s</director>\n' % html_escape(director))
+            for writer in p.writers:
+                parts.append('<writer>%s</writer>\n' % html_escape(writer))
+            for producer in p.producers:
+                parts.append('<producer>%s</producer>\n' % html_escape(producer))
+            parts.append('</credits>\n')
+        if p.seasonNo and p.episodeNo:
+            parts.append('<episode-num system="xmltv_ns">%d.%d.</episode-num>\n' % (p.seasonNo - 1, p.episodeNo - 1))
+        parts.append('</programme>\n')
+        self._write(''.join(parts))
+        self.programmes += 1
+
+    def close(self):
+        if self._file is not None:
+            self._write('</tv>\n')
+            self._flush()
+            if self.file_name is None:
+                self.value = self._file.getvalue()
+            self._file.close()
+            self._file = None
+            if self.file_name is not None:
+                os.replace(self._tmp_name, self.file_name)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if self.file_name is not None:
+                os.remove(self._tmp_name)
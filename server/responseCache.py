@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from django.http import HttpResponse, HttpResponseNotModified, HttpRequest
+from django.utils.http import http_date, parse_http_date_safe
+
+
+class CachedBody:
+    def __init__(self, body, content_type, last_modified, expires=None):
+        # type: (bytes, str, float, Optional[float]) -> None
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6)
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.gzip_etag = self.etag[:-1] + '-gzip"'
+        self.last_modified = int(last_modified)
+        # epoch time after which the body has to be built again, None if it lasts until the next EPG
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    Rendered EPG responses kept in memory until a new EPG is generated.
+
+    Every entry remembers the EPG version it was built from (mtime of the XMLTV file),
+    so an EPG generated by another process invalidates it as well.
+    """
+
+    def __init__(self):
+        self._entries = {}  # type: Dict[str, tuple]
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        # type: (str, float, Callable[[], CachedBody]) -> CachedBody
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry_version, body = entry
+            if entry_version == version and (body.expires is None or body.expires > time.time()):
+                return body
+        body = build()
+        with self._lock:
+            self._entries[key] = (version, body)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def cached_response(request, body):
+    # type: (HttpRequest, CachedBody) -> HttpResponse
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = body.gzip_etag if use_gzip else body.etag
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if (if_none_match is not None and etag in [t.strip() for t in if_none_match.split(',')]) or (
+            if_none_match is None and if_modified_since is not None and if_modified_since >= body.last_modified):
+        response = HttpResponseNotModified()
+    elif use_gzip:
+        response = HttpResponse(body.gzipped, content_type=body.content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(body.body, content_type=body.content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(body.last_modified)
+    response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,196 @@
+"""
+Process-wide Magio client, recording scheduler, EPG generation and uploader.
+
+Everything is built on first use, so importing the views stays cheap and workers boot even without
+credentials: a missing USERNAME or PASSWORD only fails the requests which need the Magio API.
+"""
+import logging
+import os
+import re
+import threading
+
+from libs.metrics import REGISTRY
+
+# a .gz or .xz file name writes the guide compressed
+epg_file = os.environ.get('EPG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'epg.xml'))
+
+_lock = threading.RLock()
+_service = None
+_pool = None
+_async_services = {}
+_scheduler = None
+_generation = None
+_uploader = None
+_background_pid = None
+_logging_configured = False
+
+
+def configure_logging():
+    global _logging_configured
+    with _lock:
+        if not _logging_configured:
+            os.makedirs('log', exist_ok=True)
+            logging.basicConfig(filename='log/errors.log', format='%(asctime)s %(message)s', level=logging.ERROR)
+            _logging_configured = True
+
+
+def get_service():
+    global _service
+    if _service is None:
+        with _lock:
+            if _service is None:
+                configure_logging()
+                username = os.environ.get('USERNAME')
+                password = os.environ.get('PASSWORD')
+                if username is None or password is None:
+                    raise EnvironmentError('Environmental variables "USERNAME" or "PASSWORD" are missing')
+
+                from libs.lineup import Lineup
+                from libs.magioService import Magio
+                _service = Magio(
+                    username, password, 2, 3,
+                    pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+                    device_quota=_device_quota(),
+                    max_in_flight=int(os.environ.get('EPG_MAX_IN_FLIGHT', 4)),
+                    rate_limit=float(os.environ.get('EPG_RATE_LIMIT', 10)),
+                    cache_dir=os.environ.get('EPG_CACHE_DIR', os.path.join(os.path.curdir, 'data/cache')),
+                    store_file=os.environ.get('EPG_DB', os.path.join(os.path.curdir, 'data/epg.sqlite3')),
+                    base_url=os.environ.get('MAGIO_API_URL', 'https://skgo.magio.tv'),
+                    trace_dir=os.environ.get('EPG_TRACE_DIR'),
+                    lineup=Lineup.load(os.environ.get('LINEUP_FILE', os.path.join(os.path.curdir, 'data/lineup.json'))))
+    return _service
+
+
+def _device_quota():
+    return int(os.environ.get('DEVICE_QUOTA', 0)) or None
+
+
+def get_pool():
+    """The account of USERNAME and PASSWORD followed by the extra `user:password` accounts in ACCOUNTS."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                from libs.accountPool import AccountPool
+                from libs.magioService import Magio
+                service = get_service()
+                accounts = [service]
+                for entry in os.environ.get('ACCOUNTS', '').split(','):
+                    username, _, password = entry.strip().partition(':')
+                    if username and password:
+                        # every account keeps its own tokens and device id, only EPG generation stays on the first
+                        accounts.append(Magio(
+                            username, password, pool_size=service._http.pool_size, base_url=service.base_url,
+                            storage_file=os.path.join(os.path.curdir, 'store-%s.json' % re.sub(r'\W', '_', username)),
+                            lineup=service.lineup, device_quota=_device_quota()))
+                _pool = AccountPool(accounts, os.path.join(os.path.curdir, 'data/accounts.sqlite3'),
+                                    recordings=lambda: get_scheduler().account_load())
+    return _pool
+
+
+def get_async_service(magio=None):
+    """asyncio client of `magio`, by default of the first account."""
+    magio = magio or get_service()
+    service = _async_services.get(id(magio))
+    if service is None:
+        with _lock:
+            service = _async_services.get(id(magio))
+            if service is None:
+                from libs.asyncMagio import AsyncMagio
+                service = _async_services[id(magio)] = AsyncMagio(magio)
+    return service
+
+
+def _make_recorder(job):
+    from libs.recorder import Recorder
+    accounts = get_pool().accounts
+    service = accounts[job.account] if job.account is not None and job.account < len(accounts) else accounts[0]
+    return Recorder(service.get_stream(job.channel_id), job.duration,
+                    mode=os.environ.get('RECORDING_MODE', 'copy'),
+                    output_dir=os.environ.get('RECORDINGS_DIR', 'data'),
+                    segment_time=int(os.environ.get('RECORDING_SEGMENT_TIME', 10)),
+                    segment_list_size=int(os.environ.get('RECORDING_SEGMENTS', 0)),
+                    url_provider=lambda: service.get_stream(job.channel_id, refresh=True),
+                    stall_timeout=int(os.environ.get('RECORDING_STALL_TIMEOUT', 30)))
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                from libs.scheduler import RecordingScheduler
+                _scheduler = RecordingScheduler(
+                    os.environ.get('RECORDINGS_DB', os.path.join(os.path.curdir, 'data/recordings.sqlite3')),
+                    _make_recorder, max_workers=int(os.environ.get('RECORDING_WORKERS', 2)),
+                    assign_account=lambda recordings: get_pool().for_recording(recordings))
+    return _scheduler
+
+
+def get_uploader():
+    global _uploader
+    if _uploader is None:
+        with _lock:
+            if _uploader is None:
+                from libs.uploader import Uploader
+                targets = os.environ.get('UPLOAD_TARGETS', 'http://epg.borec.cz/datastorage.php')
+                _uploader = Uploader([t.strip() for t in targets.split(',') if t.strip()],
+                                     os.path.join(os.path.curdir, 'data/upload-state.json'),
+                                     compress=os.environ.get('UPLOAD_GZIP', '0') == '1')
+    return _uploader
+
+
+def _run_generating_epg(progress):
+    service = get_service()
+    service.generate(epg_file, progress)
+    progress('rescheduling')
+    get_scheduler().reschedule(service.store.programme)
+    print("Uploading to borec")
+    progress('uploading')
+    result = get_uploader().upload(epg_file)
+    print("Done! " + ', '.join('%s: %s' % r for r in result.items()))
+
+
+def get_generation():
+    global _generation
+    if _generation is None:
+        with _lock:
+            if _generation is None:
+                from libs.generationWorker import GenerationWorker
+                _generation = GenerationWorker(
+                    _run_generating_epg, os.path.join(os.path.curdir, 'data/generate-status.json'),
+                    interval=int(os.environ.get('EPG_REFRESH_INTERVAL', 0)) * 60 or None)
+    return _generation
+
+
+def start_background():
+    """
+    Starts the recording scheduler and the periodic EPG generation, once per process. Only server processes
+    call it, a process which merely imports the app must not claim recordings it will not live to finish.
+    """
+    global _background_pid
+    with _lock:
+        # threads do not survive a fork, a forked worker starts its own
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    configure_logging()
+    get_scheduler().start()
+    get_generation().start_schedule()
+
+
+def warm_up():
+    """Logs in and loads the channel list, meant for a master process before it forks its workers."""
+    get_service().warm_up()
+
+
+REGISTRY.gauge('magio_recordings_active', 'Recordings running in all processes',
+               function=lambda: _scheduler.running() if _scheduler is not None else None)
+REGISTRY.gauge('magio_api_connections', 'Connections opened and reused and requests sent by the Magio API pool',
+               ('kind',), function=lambda: {(k,): v for k, v in _service.connection_stats().items()}
+               if _service is not None else None)
+REGISTRY.gauge('magio_lookup_cache', 'Hits, misses and size of the channel, stream url and device cache', ('kind',),
+               function=lambda: {(k,): v for k, v in _service.cache_stats().items()} if _service is not None else None)
+REGISTRY.gauge('magio_account_load', 'Recordings and live streams per Magio account', ('account', 'kind'),
+               function=lambda: {(user, kind): value for user, load in _pool.stats().items()
+                                 for kind, value in load.items()} if _pool is not None else None)
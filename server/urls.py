@@ -19,6 +19,16 @@ from . import views
 urlpatterns = [
     path('', views.index),
     path('record', views.record),
+    path('recordings', views.recordings),
+    path('recordings/<int:job_id>', views.recording),
+    path('recordings/<int:job_id>/cancel', views.cancel_recording),
     path('channels', views.channels),
-    path('generate-epg', views.generate_epg)
+    path('playlist.m3u', views.playlist),
+    path('stream/<int:channel_id>', views.stream),
+    path('generate-epg', views.generate_epg),
+    path('generate-epg/status', views.generate_epg_status),
+    path('epg.xml', views.epg),
+    path('epg/<int:channel_id>.xml', views.epg_channel),
+    path('now-next', views.now_next),
+    path('metrics', views.metrics),
 ]
@@ -1,29 +1,25 @@
-from django.http import HttpResponse, HttpRequest
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpRequest, Http404, HttpResponseRedirect
 import json
-import logging
 
 import os
+import re
+import time
 from datetime import datetime
-import pytz
 from django.views.decorators.csrf import csrf_exempt
-import requests
+from django.views.decorators.http import require_POST
 
-from libs import magioService
-from libs.recorder import Recorder
-from multiprocessing import Pool
+from libs.metrics import REGISTRY
+from libs.playlist import m3u
+from libs.xmltv import XmltvWriter, open_xmltv
+from server.responseCache import ResponseCache, CachedBody, cached_response
+from server.service import epg_file, get_async_service, get_generation, get_pool, get_scheduler, get_service
 
-logging.basicConfig(filename='log/errors.log', format='%(asctime)s %(message)s', level=logging.ERROR)
-
-username = os.environ.get('USERNAME')
-password = os.environ.get('PASSWORD')
-if username is None or password is None:
-    raise EnvironmentError('Environmental variables "USERNAME" or "PASSWORD" are missing')
-
-service = magioService.Magio(os.environ.get('USERNAME'), os.environ.get('PASSWORD'), 2, 3)
+responses = ResponseCache()
 
 
 def index(request):
-    epg_file = os.path.join(os.path.curdir, 'data/epg.xml')
+    import pytz
     if not os.path.exists(epg_file):
         return "No EPG file generated yet"
     time_float = os.path.getmtime(epg_file)
@@ -32,35 +28,179 @@ def index(request):
     return HttpResponse("Last updated: " + local.strftime('%d.%m.%Y %H:%M:%S'))
 
 
+def _parse_start(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+async def _schedule_programmes(request):
+    before = int(float(request.POST.get('before', os.environ.get('RECORDING_PADDING_BEFORE', 2))) * 60)
+    after = int(float(request.POST.get('after', os.environ.get('RECORDING_PADDING_AFTER', 5))) * 60)
+    magio = get_async_service().magio
+    programme_ids = request.POST.getlist('programme')
+    for programme_id in programme_ids:
+        if not programme_id.isdigit():
+            raise Http404("No upcoming programme %s in EPG" % programme_id)
+
+    def find_programme(programme_id):
+        programme = magio.store.programme(programme_id)
+        if programme is not None:
+            channel = magio.get_channel(int(programme['channel']))
+            programme['name'] = re.sub(r'[^\w-]', '', (channel.name + '-' + programme['title']).lower())
+        return programme
+
+    # an unknown programme schedules none of them
+    try:
+        ids = await sync_to_async(get_scheduler().schedule_programmes, thread_sensitive=False)(
+            [int(i) for i in programme_ids], find_programme, before, after)
+    except KeyError as e:
+        raise Http404("No upcoming programme %s in EPG" % e.args[0])
+    return HttpResponse(json.dumps({'ids': ids}), content_type='application/json')
+
+
+async def record(request: HttpRequest):
+    if request.POST.get('programme'):
+        return await _schedule_programmes(request)
+    channel = await get_async_service().get_channel(int(request.POST.get('channel')))
+    start_at = _parse_start(request.POST.get('start'))
+    start = datetime.fromtimestamp(start_at) if start_at else datetime.now()
+    job_id = await sync_to_async(get_scheduler().schedule, thread_sensitive=False)(
+        channel.id, ''.join(channel.name.split()).lower() + "-" + start.isoformat(),
+        float(request.POST.get('duration')), start_at)
+    return HttpResponse(json.dumps({'id': job_id}), content_type='application/json')
+
+
+# csrf_exempt only wraps async views since Django 5.0
+record.csrf_exempt = True
+
+
+def recordings(request):
+    return HttpResponse(json.dumps([j.to_dict() for j in get_scheduler().jobs()]), content_type='application/json')
+
+
+def recording(request, job_id):
+    job = get_scheduler().job(job_id)
+    if job is None:
+        raise Http404("No recording %d" % job_id)
+    content = job.to_dict()
+    content['progress'] = get_scheduler().progress(job_id)
+    return HttpResponse(json.dumps(content), content_type='application/json')
+
+
 @csrf_exempt
-def record(request: HttpRequest):
-    channel = service.get_channel(int(request.POST.get('channel')))
-    stream = service.get_stream(channel.id)
-    recorder = Recorder(stream, float(request.POST.get('duration')))
-    recorder.start(''.join(channel.name.split()).lower() + "-" + datetime.now().isoformat())
-    return HttpResponse("Done")
+@require_POST
+def cancel_recording(request, job_id):
+    if not get_scheduler().cancel(job_id):
+        raise Http404("No queued or running recording %d" % job_id)
+    return HttpResponse(json.dumps(get_scheduler().job(job_id).to_dict()), content_type='application/json')
 
 
-def channels(request):
-    data = service.get_channels()
+async def channels(request):
+    service = get_async_service()
+    if request.GET.get('all'):
+        data = await service.get_channels()
+    else:
+        data = await service.get_lineup(request.GET.get('group'))
     content = {c.id: c.name for (k, c) in data.items()}
     return HttpResponse(json.dumps(content))
 
 
-def _run_generating_epg():
-    epg_file = os.path.dirname(os.path.abspath(__file__)) + "/../data/epg.xml"
-    service.generate(epg_file)
-    print("Uploading to borec")
-    r = requests.put('http://epg.borec.cz/datastorage.php', data=open(epg_file, 'rb'))
-    if r.status_code == 200:
-        print("Done!")
-    else:
-        logging.error('Uploading to borec.cz failed!')
+async def playlist(request):
+    service = get_async_service()
+    channels = await service.get_channels()
+    lineup = service.magio.lineup
+    query = '?profile=' + request.GET['profile'] if request.GET.get('profile') else ''
+    content = m3u(lineup.select(channels, request.GET.get('group')),
+                  lambda channel_id: request.build_absolute_uri('/stream/%d%s' % (channel_id, query)),
+                  request.build_absolute_uri('/epg.xml'), lineup.channel_groups(channels))
+    return HttpResponse(content, content_type='audio/x-mpegurl; charset=utf-8')
+
+
+async def stream(request, channel_id):
+    # players follow the redirect, stream urls are cached until shortly before they expire
+    if channel_id not in await get_async_service().get_channels():
+        raise Http404("No channel %d" % channel_id)
+    service = get_async_service(get_pool().for_stream(channel_id))
+    return HttpResponseRedirect(await service.get_stream(channel_id, request.GET.get('profile', 'p3')))
 
 
 # generate epg and upload to borec
 def generate_epg(request):
-    pool = Pool(processes=1)
-    pool.apply_async(_run_generating_epg)
-    return HttpResponse("Epg creating started !")
+    if get_generation().trigger():
+        return HttpResponse("Epg creating started !")
+    return HttpResponse("Epg creating already running !")
+
+
+def generate_epg_status(request):
+    return HttpResponse(json.dumps(get_generation().status()), content_type='application/json')
+
+
+def _epg_version():
+    # the XMLTV file is replaced atomically at the end of every generation, its mtime identifies the EPG
+    try:
+        return os.path.getmtime(epg_file)
+    except OSError:
+        return 0.0
+
+
+async def _cached(key, version, build):
+    # building reads files and SQLite, it runs in a thread
+    return await sync_to_async(responses.get, thread_sensitive=False)(key, version, build)
+
+
+async def epg(request):
+    version = _epg_version()
+    if not version:
+        raise Http404("No EPG file generated yet")
+
+    def build():
+        with open_xmltv(epg_file) as f:
+            return CachedBody(f.read(), 'application/xml; charset=utf-8', version)
+
+    return cached_response(request, await _cached('epg', version, build))
+
+
+async def epg_channel(request, channel_id):
+    version = _epg_version()
+
+    def build():
+        from libs.magioService import Programme
+        programmes = get_service().store.programmes(str(channel_id), 0, 2 ** 40)
+        if not programmes:
+            raise Http404("No EPG for channel %d" % channel_id)
+        with XmltvWriter() as writer:
+            writer.write_channel(channel_id)
+            for p in programmes:
+                writer.write_programme(channel_id, Programme.from_dict(p))
+        return CachedBody(writer.value.encode('utf8'), 'application/xml; charset=utf-8', version or time.time())
+
+    return cached_response(request, await _cached('epg-%d' % channel_id, version, build))
+
+
+async def now_next(request):
+    version = _epg_version()
+
+    def build():
+        def summary(p):
+            if p is None:
+                return None
+            return {k: p[k] for k in ('id', 'title', 'description', 'thumbnail', 'start_time', 'end_time')}
+
+        now = int(time.time())
+        data = get_service().store.now_next(now)
+        # the response is valid until the first of the current programmes ends
+        changes = [v['now']['end_time'] for v in data.values() if v['now'] is not None] + \
+                  [v['next']['start_time'] for v in data.values() if v['next'] is not None]
+        content = {c: {k: summary(p) for k, p in v.items()} for c, v in data.items()}
+        return CachedBody(json.dumps(content).encode('utf8'), 'application/json', now,
+                          min(changes) if changes else now + 60)
+
+    return cached_response(request, await _cached('now-next', version, build))
+
 
+def metrics(request):
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from libs.epgCache import EpgCache
+from libs.magioService import Magio, MagioGoException
+from libs.ttlCache import TtlCache
+
+
+class TtlCacheTest(unittest.TestCase):
+    def test_concurrent_misses_load_once(self):
+        cache = TtlCache()
+        loads = []
+        release = threading.Event()
+
+        def loader():
+            loads.append(1)
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('key', loader, 60))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(cache.stats()['misses'] + cache.stats()['coalesced'] + cache.stats()['hits'], 8)
+
+    def test_ttl_may_depend_on_the_value(self):
+        cache = TtlCache()
+        ttl = {'short': 0.05, 'long': 60}.get
+        cache.get('a', lambda: 'short', ttl)
+        cache.get('b', lambda: 'long', ttl)
+        time.sleep(0.1)
+        self.assertIsNone(cache.peek('a'))
+        self.assertEqual(cache.peek('b'), 'long')
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TtlCache(max_size=2)
+        cache.put('a', 1, 60)
+        cache.put('b', 2, 60)
+        self.assertEqual(cache.peek('a'), 1)
+        cache.put('c', 3, 60)
+        self.assertEqual((cache.peek('a'), cache.peek('b'), cache.peek('c')), (1, None, 3))
+
+    def test_load_error_reaches_every_waiting_caller_and_is_not_cached(self):
+        cache = TtlCache()
+        release = threading.Event()
+
+        def loader():
+            release.wait(5)
+            raise ConnectionError('down')
+
+        errors = []
+
+        def get():
+            try:
+                cache.get('key', loader, 60)
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(cache.get('key', lambda: 'value', 60), 'value')
+
+
+class EpgCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = EpgCache(self.directory.name, today_ttl=60, future_ttl=3600)
+        self.today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_evict_removes_days_out_of_the_window_and_unfinished_writes(self):
+        old = self.today - timedelta(days=10)
+        self.cache.put(old, {}, 'scope')
+        self.cache.put(self.today, {}, 'scope')
+        for day in (old, self.today):
+            with open(self.cache._file(day, 'scope') + '.tmp', 'w') as f:
+                f.write('{')
+
+        self.cache.evict([self.today])
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         sorted(os.path.basename(self.cache._file(self.today, 'scope')) + s for s in ('', '.tmp')))
+
+    def test_today_expires_after_its_ttl(self):
+        self.cache.put(self.today, {'1': []})
+        file = self.cache._file(self.today)
+        self.assertTrue(self.cache.is_fresh(self.today))
+        os.utime(file, (time.time() - 120, time.time() - 120))
+        self.assertFalse(self.cache.is_fresh(self.today))
+        # a past day never expires
+        self.assertTrue(self.cache.is_fresh(self.today, self.today + timedelta(days=1)))
+
+
+class LookupInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def failed(self, code):
+        # a failed response drops the session, which is stored
+        magio = Magio('', '', storage_file=os.path.join(self.directory.name, 'store.json'))
+        magio._lookups.put('channels', {}, 60)
+        magio._lookups.put('devices', [], 60)
+        with self.assertRaises(MagioGoException):
+            magio._check_response({'success': False, 'errorMessage': 'failed', 'errorCode': code})
+        return magio._lookups.peek('channels'), magio._lookups.peek('devices')
+
+    def test_session_errors_drop_every_lookup(self):
+        self.assertEqual(self.failed('INVALID_TOKEN'), (None, None))
+
+    def test_device_limit_drops_the_device_list_only(self):
+        self.assertEqual(self.failed('DEVICE_MAX_LIMIT'), ({}, None))
+
+    def test_other_errors_keep_the_lookups(self):
+        self.assertEqual(self.failed('CHANNEL_NOT_FOUND'), ({}, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from benchmarks.fakeMagio import FakeMagio
+from benchmarks.synthetic import epg_items
+from libs.epgFetcher import EpgFetcher, RateLimiter
+from libs.magioService import EPG_PAGE_SIZE, Magio, Programme, timeline
+
+
+def programme(start, minutes, programme_id=1):
+    p = Programme()
+    p.id = programme_id
+    p.start_time = start
+    p.end_time = start + timedelta(minutes=minutes)
+    p.duration = minutes * 60
+    return p
+
+
+class EpgPagingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self, channels, per_day=4):
+        with FakeMagio(channels=channels, per_day=per_day) as fake:
+            magio = Magio('user', 'password', base_url=fake.url,
+                          storage_file=os.path.join(self.directory.name, 'store.json'))
+            epg = magio._epg(range(1, channels + 1), self.day, self.day)
+            return epg, fake.requests['/v2/television/epg'], magio.stats
+
+    def test_pages_until_a_short_page(self):
+        epg, requests, stats = self.fetch(EPG_PAGE_SIZE * 2 + 50)
+        self.assertEqual(requests, 3)
+        self.assertEqual(len(epg), EPG_PAGE_SIZE * 2 + 50)
+        self.assertTrue(all(len(programmes) == 4 for programmes in epg.values()))
+        self.assertEqual(stats.duplicates, 0)
+
+    def test_full_last_page_is_followed_by_an_empty_one(self):
+        epg, requests, _ = self.fetch(EPG_PAGE_SIZE * 2)
+        self.assertEqual(requests, 3)
+        self.assertEqual(len(epg), EPG_PAGE_SIZE * 2)
+
+    def test_programmes_start_within_the_day(self):
+        epg, _, _ = self.fetch(3)
+        for programmes in epg.values():
+            self.assertTrue(all(self.day <= p.start_time < self.day + timedelta(days=1) for p in programmes))
+
+
+class EpgFetcherTest(unittest.TestCase):
+    def test_reads_a_bounded_number_of_keys_ahead(self):
+        requested = []
+        lock = threading.Lock()
+
+        def fetch_page(key, page):
+            with lock:
+                requested.append((key, page))
+            return [(key, page)], page < 2
+
+        fetcher = EpgFetcher(max_in_flight=2, rate_limiter=RateLimiter(0))
+        results = fetcher.fetch('host', range(10), fetch_page)
+        key, items = next(results)
+        self.assertEqual((key, items), (0, [(0, 0), (0, 1), (0, 2)]))
+        # the first key's later pages go before further keys, no key past the lookahead is started
+        self.assertLessEqual(max(k for k, _ in requested), 2)
+        self.assertEqual([k for k, _ in requested].count(0), 3)
+
+        self.assertEqual([k for k, _ in results], list(range(1, 10)))
+        self.assertEqual(len(requested), 30)
+
+
+class EpgDayTest(unittest.TestCase):
+    def test_duplicate_entries_are_parsed_once(self):
+        day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        items = epg_items(day, channels=3, per_day=6)
+        # an entry repeated on the next page, e.g. because the listing shifted between requests
+        items.append({'programs': items[0]['programs'][:2]})
+        magio = Magio('', '')
+        epg = magio._epg_day({'1', '2', '3'}, items, day + timedelta(hours=12))
+
+        self.assertEqual(magio.stats.fetched, 20)
+        self.assertEqual(magio.stats.duplicates, 2)
+        self.assertEqual(magio.stats.parsed, 18)
+        self.assertEqual([len(epg[c]) for c in ('1', '2', '3')], [6, 6, 6])
+        self.assertEqual(len({p.id for p in epg['1']}), 6)
+
+    def test_channels_outside_the_lineup_are_skipped(self):
+        day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        magio = Magio('', '')
+        epg = magio._epg_day({'2'}, epg_items(day, channels=3, per_day=2), day)
+        self.assertEqual(list(epg), ['2'])
+        self.assertEqual(magio.stats.fetched, 6)
+
+    def test_replay_window(self):
+        now = datetime(2024, 5, 10, 13)
+        items = epg_items(now - timedelta(days=8), channels=1, per_day=2) + \
+            epg_items(now, channels=1, per_day=2)
+        epg = Magio('', '')._epg_day({'1'}, items, now)
+        # a week old programmes and the one still on air can not be replayed
+        self.assertEqual([p.is_replyable for p in epg['1']], [False, False, True, False])
+
+
+class TimelineTest(unittest.TestCase):
+    def test_overlapping_programme_is_cut_short(self):
+        start = datetime(2024, 5, 10, 20)
+        first, second = programme(start, 90, 1), programme(start + timedelta(minutes=60), 60, 2)
+        self.assertEqual(timeline([second, first]), [first, second])
+        self.assertEqual(first.end_time, second.start_time)
+        self.assertEqual(first.duration, 3600)
+
+    def test_longest_of_programmes_starting_together_is_kept(self):
+        start = datetime(2024, 5, 10, 20)
+        short, long = programme(start, 30, 1), programme(start, 90, 2)
+        self.assertEqual(timeline([long, short]), [long])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import closing
+
+from libs.scheduler import CANCELLED, DONE, FAILED, QUEUED, RUNNING, RecordingScheduler
+
+
+class BlockingRecorder:
+    """Stands in for a Recorder, records until `stop()` or until the test finishes it."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+
+    def start(self, name):
+        self.started.set()
+        self.finish.wait(10)
+        return name + '.ts'
+
+    def stop(self):
+        self.finish.set()
+
+
+def programme(programme_id, start_time, end_time):
+    return {'id': programme_id, 'channel': '1', 'name': 'programme%d' % programme_id,
+            'start_time': start_time, 'end_time': end_time}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class RecordingSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, 'recordings.sqlite3')
+        self.recorders = {}
+        self.lock = threading.Lock()
+        self.schedulers = []
+
+    def tearDown(self):
+        for scheduler in self.schedulers:
+            scheduler.stop()
+        with self.lock:
+            recorders = list(self.recorders.values())
+        for recorder in recorders:
+            recorder.finish.set()
+        for scheduler in self.schedulers:
+            if scheduler._executor is not None:
+                scheduler._executor.shutdown(wait=True)
+        self.directory.cleanup()
+
+    def make_recorder(self, job):
+        recorder = BlockingRecorder()
+        with self.lock:
+            self.recorders[job.id] = recorder
+        return recorder
+
+    def scheduler(self, owner=None, max_workers=2):
+        scheduler = RecordingScheduler(self.file_name, self.make_recorder, max_workers=max_workers,
+                                       poll_interval=0.05)
+        if owner is not None:
+            # stands for another worker process sharing the queue
+            scheduler.owner = owner
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def statuses(self, scheduler):
+        return {job.id: job.status for job in scheduler.jobs()}
+
+    def test_claims_at_most_max_workers_across_schedulers(self):
+        first = self.scheduler()
+        second = self.scheduler(owner='other-host:1')
+        ids = [first.schedule(1, 'job%d' % n, 1, time.time() - 1) for n in range(5)]
+        first.start()
+        second.start()
+
+        self.assertTrue(wait_for(lambda: first.running() == 2))
+        time.sleep(0.3)
+        self.assertEqual(first.running(), 2)
+        self.assertEqual(len(self.recorders), 2)
+        self.assertEqual(sorted(self.recorders), ids[:2])
+
+        self.recorders[ids[0]].finish.set()
+        self.assertTrue(wait_for(lambda: self.statuses(first)[ids[0]] == DONE and ids[2] in self.recorders))
+        self.assertEqual(first.running(), 2)
+        self.assertEqual(first.job(ids[0]).output, 'job0.ts')
+        # every job is recorded by exactly one scheduler
+        self.assertEqual(len(self.recorders), 3)
+
+    def test_claims_spread_over_accounts_across_schedulers(self):
+        def least_loaded(recordings):
+            return min(range(2), key=lambda account: recordings.get(account, 0))
+
+        schedulers = [self.scheduler(), self.scheduler(owner='other-host:1')]
+        for scheduler in schedulers:
+            scheduler.assign_account = least_loaded
+        ids = [schedulers[0].schedule(1, 'job%d' % n, 1, time.time() - 1) for n in range(2)]
+        for scheduler in schedulers:
+            scheduler.start()
+
+        self.assertTrue(wait_for(lambda: len(self.recorders) == 2))
+        self.assertEqual(sorted(schedulers[0].job(job_id).account for job_id in ids), [0, 1])
+        self.assertEqual(schedulers[1].account_load(), {0: 1, 1: 1})
+
+    def test_does_not_claim_future_jobs(self):
+        scheduler = self.scheduler()
+        job_id = scheduler.schedule(1, 'later', 1, time.time() + 3600)
+        scheduler.start()
+        time.sleep(0.3)
+        self.assertEqual(scheduler.job(job_id).status, QUEUED)
+
+    def test_cancel_queued_job(self):
+        scheduler = self.scheduler()
+        job_id = scheduler.schedule(1, 'queued', 1, time.time() + 3600)
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertEqual(scheduler.job(job_id).status, CANCELLED)
+        self.assertFalse(scheduler.cancel(job_id))
+
+        scheduler.start()
+        time.sleep(0.3)
+        self.assertNotIn(job_id, self.recorders)
+
+    def test_cancel_running_job_stops_its_recorder(self):
+        scheduler = self.scheduler()
+        job_id = scheduler.schedule(1, 'running', 1)
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: job_id in self.recorders and self.recorders[job_id].started.is_set()))
+
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertTrue(wait_for(lambda: scheduler.job(job_id).status == CANCELLED))
+        self.assertTrue(self.recorders[job_id].finish.is_set())
+        self.assertEqual(scheduler.running(), 0)
+
+    def test_failed_recording_frees_its_slot(self):
+        def make_recorder(job):
+            raise KeyboardInterrupt('not an Exception')
+
+        scheduler = RecordingScheduler(self.file_name, make_recorder, max_workers=1, poll_interval=0.05)
+        self.schedulers.append(scheduler)
+        job_id = scheduler.schedule(1, 'failing', 1)
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: scheduler.job(job_id).status == FAILED))
+        self.assertEqual(scheduler.running(), 0)
+
+    def test_recover_fails_jobs_of_dead_owners_only(self):
+        scheduler = self.scheduler()
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        now = int(time.time())
+        owners = {'orphan': ('%s:%d' % (socket.gethostname(), dead.pid), now),
+                  'alive': ('%s:%d' % (socket.gethostname(), os.getpid()), now),
+                  # a container which is gone, its host name is not this one
+                  'stale': ('other-host:1', now - scheduler.stale_after - 1),
+                  'remote': ('other-host:1', now)}
+        ids = {name: scheduler.schedule(1, name, 1, time.time() + 3600) for name in owners}
+        with closing(scheduler._connect()) as conn:
+            for name, (owner, heartbeat_at) in owners.items():
+                conn.execute('UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ? WHERE id = ?',
+                             (RUNNING, owner, heartbeat_at, ids[name]))
+
+        scheduler._recover()
+        self.assertEqual({name: scheduler.job(job_id).status for name, job_id in ids.items()},
+                         {'orphan': FAILED, 'alive': RUNNING, 'stale': FAILED, 'remote': RUNNING})
+        self.assertEqual(scheduler.job(ids['stale']).error, 'interrupted')
+
+    def test_programme_window_includes_padding(self):
+        scheduler = self.scheduler()
+        now = int(time.time())
+        job = scheduler.job(scheduler.schedule_programme(programme(1, now + 3600, now + 7200), 120, 300))
+        self.assertEqual((job.start_at, job.duration), (now + 3600 - 120, (3600 + 120 + 300) / 60))
+        self.assertEqual((job.programme_id, job.padding_before, job.padding_after), (1, 120, 300))
+
+    def test_programme_on_air_is_recorded_from_now(self):
+        scheduler = self.scheduler()
+        now = int(time.time())
+        job = scheduler.job(scheduler.schedule_programme(programme(1, now - 600, now + 600), 120, 300))
+        self.assertAlmostEqual(job.start_at, now, delta=1)
+        self.assertAlmostEqual(job.duration, (now + 900 - job.start_at) / 60)
+
+    def test_ended_programme_is_not_scheduled(self):
+        scheduler = self.scheduler()
+        now = int(time.time())
+        with self.assertRaises(ValueError):
+            scheduler.schedule_programme(programme(1, now - 3600, now - 600), 120, 300)
+        self.assertEqual(scheduler.jobs(), [])
+
+    def test_reschedule_follows_a_later_epg(self):
+        scheduler = self.scheduler()
+        now = int(time.time())
+        job_id = scheduler.schedule_programme(programme(1, now + 3600, now + 7200), 60, 60)
+        unchanged = scheduler.schedule_programme(programme(2, now + 7200, now + 9000))
+        epg = {1: programme(1, now + 5400, now + 9000), 2: programme(2, now + 7200, now + 9000)}
+
+        self.assertEqual(scheduler.reschedule(epg.get), 1)
+        job = scheduler.job(job_id)
+        self.assertEqual((job.start_at, job.duration), (now + 5400 - 60, (3600 + 120) / 60))
+        self.assertEqual(scheduler.job(unchanged).start_at, now + 7200)
+
+    def test_unknown_programme_schedules_none(self):
+        scheduler = self.scheduler()
+        now = int(time.time())
+        epg = {1: programme(1, now + 3600, now + 7200), 2: programme(2, now - 3600, now - 600)}
+        with self.assertRaises(KeyError):
+            scheduler.schedule_programmes([1, 3], epg.get)
+        with self.assertRaises(ValueError):
+            scheduler.schedule_programmes([1, 2], epg.get)
+        self.assertEqual(scheduler.jobs(), [])
+        self.assertEqual(len(scheduler.schedule_programmes([1], epg.get)), 1)
+
+    def test_running_jobs_keep_their_heartbeat_fresh(self):
+        scheduler = RecordingScheduler(self.file_name, self.make_recorder, poll_interval=0.05, stale_after=1)
+        self.schedulers.append(scheduler)
+        job_id = scheduler.schedule(1, 'long', 1)
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: job_id in self.recorders))
+
+        time.sleep(2.5)
+        job = scheduler.job(job_id)
+        self.assertEqual(job.status, RUNNING)
+        self.assertGreaterEqual(job.heartbeat_at, int(time.time()) - 1)
+
+if __name__ == '__main__':
+    unittest.main()
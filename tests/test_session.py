@@ -0,0 +1,114 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks.fakeMagio import FakeMagio
+from libs.magioService import Magio
+from libs.session import SessionManager
+
+
+def expiry(seconds):
+    return int((time.time() + seconds) * 1000)
+
+
+class SessionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.directory.name, 'store.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_tokens_are_shared_through_the_file(self):
+        first = SessionManager(self.storage_file)
+        self.assertTrue(first.needs_login())
+        first.update('access', 'refresh', expiry(3600), 'Bearer')
+
+        second = SessionManager(self.storage_file)
+        self.assertFalse(second.needs_login())
+        self.assertFalse(second.needs_refresh())
+        self.assertEqual((second.data.access_token, second.data.type), ('access', 'Bearer'))
+
+    def test_exclusive_rereads_tokens_stored_meanwhile(self):
+        first = SessionManager(self.storage_file)
+        second = SessionManager(self.storage_file)
+        self.assertTrue(second.needs_login())
+        first.update('access', 'refresh', expiry(3600), 'Bearer')
+
+        with second.exclusive() as data:
+            self.assertEqual(data.access_token, 'access')
+        self.assertFalse(second.needs_login())
+
+    def test_unchanged_tokens_are_not_written(self):
+        session = SessionManager(self.storage_file)
+        session.update('access', 'refresh', expiry(3600), 'Bearer')
+        data = session.data
+        os.remove(self.storage_file)
+        session.update(data.access_token, data.refresh_token, data.expires_in, data.type)
+        self.assertFalse(os.path.exists(self.storage_file))
+
+    def test_refresh_is_due_within_the_margin(self):
+        session = SessionManager(self.storage_file, refresh_margin=60)
+        session.update('access', 'refresh', expiry(30), 'Bearer')
+        self.assertTrue(session.needs_refresh())
+        session.update('access', 'refresh', expiry(120), 'Bearer')
+        self.assertFalse(session.needs_refresh())
+
+    def test_clear_keeps_the_device_id(self):
+        session = SessionManager(self.storage_file)
+        device_id = session.device_id(lambda: 'device')
+        session.update('access', 'refresh', expiry(3600), 'Bearer')
+        session.clear()
+        self.assertTrue(session.needs_login())
+
+        other = SessionManager(self.storage_file)
+        self.assertTrue(other.needs_login())
+        self.assertEqual(other.device_id(lambda: 'new device'), device_id)
+
+
+class ConcurrentLoginTest(unittest.TestCase):
+    def test_clients_sharing_a_session_file_log_in_once(self):
+        with FakeMagio(channels=1, latency=0.05) as fake, tempfile.TemporaryDirectory() as directory:
+            storage_file = os.path.join(directory, 'store.json')
+            # separate clients like separate worker processes, only the file and its lock are shared
+            clients = [Magio('user', 'password', base_url=fake.url, storage_file=storage_file) for _ in range(8)]
+            threads = [threading.Thread(target=client._login) for client in clients]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(fake.requests['/v2/auth/login'], 1)
+            stored = SessionManager(storage_file)
+            stored.ensure_loaded()
+            self.assertTrue(stored.data.access_token)
+            self.assertEqual({client._data.access_token for client in clients}, {stored.data.access_token})
+
+    def test_login_over_the_device_limit_frees_a_device(self):
+        class LimitedMagio(FakeMagio):
+            limited = True
+
+            def respond(self, method, path, query):
+                if path == '/v2/auth/login' and self.limited:
+                    self.limited = False
+                    return {'success': False, 'errorMessage': 'too many devices', 'errorCode': 'DEVICE_MAX_LIMIT'}
+                return super().respond(method, path, query)
+
+        with LimitedMagio(channels=1) as fake, tempfile.TemporaryDirectory() as directory:
+            magio = Magio('user', 'password', base_url=fake.url, storage_file=os.path.join(directory, 'store.json'))
+            urls = []
+            # listing the devices logs in again while the failed login still holds the session lock
+            thread = threading.Thread(target=lambda: urls.append(magio.get_stream(1)), daemon=True)
+            thread.start()
+            thread.join(5)
+
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(len(urls), 1)
+            self.assertEqual(fake.requests['/home/deleteDevice'], 1)
+            self.assertEqual(len(fake.devices), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()